@@ -0,0 +1,220 @@
+"""
+threatspec benchmarks
+
+    # Generate a corpus and run every benchmark against it
+    $ python benchmarks/bench.py run --output results.json
+
+    # Compare with an earlier run, failing if anything got slower or bigger
+    $ python benchmarks/bench.py compare baseline.json results.json
+
+See benchmarks/README.md for details.
+"""
+
+import os
+import sys
+import json
+import shutil
+import logging
+import platform
+import tempfile
+import click
+
+import corpus
+import suite
+
+RESULTS_VERSION = 1
+
+
+def corpus_options(func):
+    options = [
+        click.option("--files", type=click.IntRange(min=1), help="Number of source files. The default is {}.".format(corpus.DEFAULTS["files"])),
+        click.option("--lines", type=click.IntRange(min=1), help="Lines of code per source file. The default is {}.".format(corpus.DEFAULTS["lines"])),
+        click.option("--languages", help="Comma separated source file extensions to cycle through, from: {}. The default is {}.".format(
+            ", ".join(corpus.LANGUAGES), ",".join(corpus.DEFAULTS["languages"]))),
+        click.option("--comment-density", type=click.FloatRange(0, 1), help="Probability of a comment before each line of code. The default is {}.".format(corpus.DEFAULTS["comment_density"])),
+        click.option("--annotation-density", type=click.FloatRange(0, 1), help="Probability that a comment contains annotations. The default is {}.".format(corpus.DEFAULTS["annotation_density"])),
+        click.option("--kinds", help="Comma separated annotation kinds to use, from: {}. The default is {}.".format(
+            ", ".join(corpus.ANNOTATIONS), ",".join(corpus.DEFAULTS["kinds"]))),
+        click.option("--extended", type=click.FloatRange(0, 1), help="Probability that annotations in a block comment or YAML file use the extended YAML syntax. The default is {}.".format(corpus.DEFAULTS["extended"])),
+        click.option("--yaml-files", type=click.IntRange(min=0), help="Number of YAML files with x-threatspec keys. The default is {}.".format(corpus.DEFAULTS["yaml_files"])),
+        click.option("--imports", type=click.IntRange(min=0), help="Number of projects imported by the corpus. The default is {}.".format(corpus.DEFAULTS["imports"])),
+        click.option("--seed", type=int, help="Random seed. The default is {}.".format(corpus.DEFAULTS["seed"]))
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def generate_corpus(directory, options):
+    for key in ["languages", "kinds"]:
+        if options.get(key):
+            options[key] = [value.strip() for value in options[key].split(",")]
+            unknown = set(options[key]) - set(corpus.LANGUAGES if key == "languages" else corpus.ANNOTATIONS)
+            if unknown:
+                raise click.BadParameter("Unknown {}: {}".format(key, ", ".join(sorted(unknown))))
+
+    options = corpus.generate(directory, **options)
+    with open(os.path.join(directory, "corpus.json"), "w") as fh:
+        json.dump(options, fh, indent=2)
+
+    project = os.getcwd()
+    os.chdir(directory)
+    try:
+        suite.prepare()
+    finally:
+        os.chdir(project)
+    return options
+
+
+def format_time(seconds):
+    if seconds < 1:
+        return "{:.2f}ms".format(seconds * 1000)
+    return "{:.3f}s".format(seconds)
+
+
+def format_memory(size):
+    if size < 1024 * 1024:
+        return "{:.1f}KB".format(size / 1024)
+    return "{:.1f}MB".format(size / (1024 * 1024))
+
+
+def format_change(base, new):
+    if not base:
+        return "n/a"
+    return "{:+.1f}%".format(100 * (new - base) / base)
+
+
+def compare_results(baseline, results, threshold=0.2, memory_threshold=0.2, min_time=0.001, min_memory=64 * 1024):
+    """Returns a row for each benchmark in both results, and the names of those that
+    regressed: the minimum time grew by more than threshold or the peak memory grew
+    by more than memory_threshold. Changes smaller than min_time seconds or
+    min_memory bytes are ignored as noise."""
+    rows = []
+    regressions = []
+    for (name, new) in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        slower = new["min"] > base["min"] * (1 + threshold) and new["min"] - base["min"] >= min_time
+        bigger = new["peak_memory"] > base["peak_memory"] * (1 + memory_threshold) and new["peak_memory"] - base["peak_memory"] >= min_memory
+        if slower or bigger:
+            regressions.append(name)
+        rows.append((name,
+                     format_time(base["min"]), format_time(new["min"]), format_change(base["min"], new["min"]),
+                     format_memory(base["peak_memory"]), format_memory(new["peak_memory"]), format_change(base["peak_memory"], new["peak_memory"]),
+                     "REGRESSION" if slower or bigger else ""))
+    return (rows, regressions)
+
+
+def print_table(header, rows):
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        click.echo("  ".join(str(cell).ljust(width) if i == 0 else str(cell).rjust(width) for (i, (cell, width)) in enumerate(zip(row, widths))).rstrip())
+
+
+def print_comparison(baseline, results, threshold, memory_threshold):
+    if baseline.get("corpus") != results.get("corpus"):
+        click.echo("Warning: the results are for different corpus options", err=True)
+    (rows, regressions) = compare_results(baseline, results, threshold, memory_threshold)
+    print_table(("Benchmark", "Base time", "Time", "Change", "Base memory", "Memory", "Change", ""), rows)
+    if regressions:
+        click.echo("\n{} benchmarks regressed: {}".format(len(regressions), ", ".join(regressions)), err=True)
+    return regressions
+
+
+def read_results(filename):
+    with open(filename) as fh:
+        results = json.load(fh)
+    if results.get("version") != RESULTS_VERSION:
+        raise click.ClickException("Unsupported results version in {}".format(filename))
+    return results
+
+
+@click.group()
+def cli():
+    """Benchmarks for threatspec, run against a synthetic corpus."""
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+
+
+@cli.command()
+@click.argument("directory", type=click.Path(file_okay=False))
+@corpus_options
+def generate(directory, **options):
+    """Generate a corpus in DIRECTORY and run threatspec in it, so that it can be
+    used with run --corpus."""
+    os.makedirs(directory, exist_ok=True)
+    generate_corpus(directory, options)
+
+
+@cli.command()
+@click.option("--corpus", "corpus_dir", type=click.Path(exists=True, file_okay=False), help="Use a corpus made with the generate command instead of generating one.")
+@corpus_options
+@click.option("--benchmark", "-b", "selected", multiple=True, type=click.Choice([bench.name for bench in suite.BENCHMARKS]), help="Only run this benchmark. Can be repeated.")
+@click.option("--repeat", "-r", type=click.IntRange(min=1), default=5, help="Number of timed runs of each benchmark. The default is 5.")
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="Write the results to this JSON file.")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Compare the results with this earlier output and exit with status 1 if any benchmark regressed.")
+@click.option("--threshold", type=float, default=0.2, help="Slowdown that counts as a regression, as a fraction. The default is 0.2.")
+@click.option("--memory-threshold", type=float, default=0.2, help="Peak memory increase that counts as a regression, as a fraction. The default is 0.2.")
+def run(corpus_dir, selected, repeat, output, baseline, threshold, memory_threshold, **options):
+    """Run the benchmarks, printing the fastest and median time of each and the peak
+    memory allocated while it runs."""
+    directory = corpus_dir or tempfile.mkdtemp(prefix="threatspec-bench-")
+    try:
+        if corpus_dir:
+            with open(os.path.join(corpus_dir, "corpus.json")) as fh:
+                corpus_config = json.load(fh)
+        else:
+            click.echo("Generating corpus in {}".format(directory), err=True)
+            corpus_config = generate_corpus(directory, options)
+
+        project = os.getcwd()
+        os.chdir(directory)
+        try:
+            rows = []
+
+            def report(name, result):
+                row = (name, format_time(result["min"]), format_time(result["median"]), format_memory(result["peak_memory"]), result["items"] or "")
+                rows.append(row)
+                click.echo("{}: {} (median {}), peak memory {}".format(*row[:4]), err=True)
+
+            benchmarks = suite.run(selected, repeat, report)
+        finally:
+            os.chdir(project)
+    finally:
+        if not corpus_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    click.echo()
+    print_table(("Benchmark", "Min", "Median", "Peak memory", "Items"), rows)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus_config,
+        "benchmarks": benchmarks
+    }
+    if output:
+        with open(output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if baseline:
+        click.echo()
+        if print_comparison(read_results(baseline), results, threshold, memory_threshold):
+            sys.exit(1)
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("results", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", type=float, default=0.2, help="Slowdown that counts as a regression, as a fraction. The default is 0.2.")
+@click.option("--memory-threshold", type=float, default=0.2, help="Peak memory increase that counts as a regression, as a fraction. The default is 0.2.")
+def compare(baseline, results, threshold, memory_threshold):
+    """Compare RESULTS with an earlier BASELINE, both written by run --output, and exit
+    with status 1 if any benchmark regressed."""
+    if print_comparison(read_results(baseline), read_results(results), threshold, memory_threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
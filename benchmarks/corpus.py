@@ -0,0 +1,168 @@
+"""Generates synthetic threatspec projects for the benchmarks.
+
+The same parameters and seed always produce the same files, so results from
+different commits are comparable.
+"""
+
+import os
+import random
+import yaml
+
+# Line comment prefix and, for languages that have them, the block comment delimiters
+LANGUAGES = {
+    "py": ("#", None),
+    "rb": ("#", None),
+    "js": ("//", ("/*", " * ", " */")),
+    "go": ("//", ("/*", " * ", " */")),
+    "java": ("//", ("/**", " * ", " */")),
+    "c": ("//", ("/*", " * ", " */"))
+}
+
+ANNOTATIONS = {
+    "mitigate": "@mitigates {component} against {threat} with {control}",
+    "expose": "@exposes {component} to {threat} with {details}",
+    "accept": "@accepts {threat} to {component} with {details}",
+    "transfer": "@transfers {threat} from {component} to {other_component} with {details}",
+    "connect": "@connects {component} to {other_component} with {details}",
+    "review": "@review {component} {details}",
+    "test": "@tests {control} for {component}",
+    "threat": "@threat {threat}",
+    "control": "@control {control}",
+    "component": "@component {component}"
+}
+
+WORDS = ["access", "token", "session", "input", "request", "upload", "cache", "queue", "secret", "record",
+         "password", "handler", "client", "server", "header", "cookie", "query", "payload", "key", "account"]
+
+DEFAULTS = {
+    "files": 200,
+    "lines": 200,
+    "languages": ["py", "js", "go", "java"],
+    "comment_density": 0.1,
+    "annotation_density": 0.5,
+    "kinds": ["mitigate", "expose", "accept", "transfer", "connect", "review", "test"],
+    "extended": 0.1,
+    "yaml_files": 10,
+    "imports": 2,
+    "threats": 60,
+    "controls": 40,
+    "components": 50,
+    "seed": 0
+}
+
+
+class Generator():
+    """Writes one project. Each source file gets code lines, some of them preceded by
+    a comment. A comment holds one or more annotations, or only prose."""
+
+    def __init__(self, options, name):
+        self.options = options
+        self.random = random.Random("{}:{}".format(options["seed"], name))
+        self.name = name
+
+    def threat(self):
+        return "{} Threat {}".format(self.name.title(), self.random.randrange(self.options["threats"]))
+
+    def control(self):
+        return "{} Control {}".format(self.name.title(), self.random.randrange(self.options["controls"]))
+
+    def component(self):
+        n = self.random.randrange(self.options["components"])
+        return "{}:Service{}:Part{}".format(self.name.title(), n % 7, n)
+
+    def details(self):
+        return " ".join(self.random.choice(WORDS) for i in range(self.random.randint(3, 8)))
+
+    def annotation(self):
+        kind = self.random.choice(self.options["kinds"])
+        return ANNOTATIONS[kind].format(
+            component=self.component(),
+            other_component=self.component(),
+            threat=self.threat(),
+            control=self.control(),
+            details=self.details())
+
+    def extension(self):
+        return [
+            "description: {}".format(self.details()),
+            "impact: {}".format(self.random.choice(["low", "medium", "high"]))
+        ]
+
+    def comment(self, language):
+        (line_prefix, block) = LANGUAGES[language]
+        if self.random.random() >= self.options["annotation_density"]:
+            return ["{} {}".format(line_prefix, self.details())]
+
+        count = 1 if self.random.random() < 0.7 else self.random.randint(2, 4)
+        annotations = [self.annotation() for i in range(count)]
+        if block and self.random.random() < self.options["extended"]:
+            (start, prefix, end) = block
+            lines = [start]
+            for annotation in annotations:
+                lines.append(prefix + annotation + ":")
+                lines += [prefix + "  " + line for line in self.extension()]
+                lines.append(prefix.rstrip())
+            return lines + [end]
+        return ["{} {}".format(line_prefix, annotation) for annotation in annotations]
+
+    def source_file(self, language, index):
+        lines = []
+        for n in range(self.options["lines"]):
+            if self.random.random() < self.options["comment_density"]:
+                lines += self.comment(language)
+            if language in ("py", "rb"):
+                lines.append("value_{0} = compute({0})".format(n))
+            else:
+                lines.append("value_{0} = compute({0});".format(n))
+        return "\n".join(lines) + "\n"
+
+    def yaml_file(self, index):
+        paths = {}
+        for n in range(self.options["lines"] // 10):
+            operation = {"summary": self.details()}
+            if self.random.random() < self.options["annotation_density"]:
+                if self.random.random() < self.options["extended"]:
+                    operation["x-threatspec"] = {self.annotation(): dict(line.split(": ", 1) for line in self.extension())}
+                else:
+                    operation["x-threatspec"] = self.annotation()
+            paths["/api/v{}/resource{}".format(index, n)] = {"get": operation}
+        return yaml.dump({"openapi": "3.0.0", "paths": paths}, default_flow_style=False)
+
+    def write(self, directory, imports=()):
+        files = []
+        for i in range(self.options["files"]):
+            language = self.options["languages"][i % len(self.options["languages"])]
+            path = os.path.join("src", "module{}".format(i % 10), "file{}.{}".format(i, language))
+            files.append((path, self.source_file(language, i)))
+        for i in range(self.options["yaml_files"]):
+            files.append((os.path.join("api", "api{}.yaml".format(i)), self.yaml_file(i)))
+
+        for (path, content) in files:
+            path = os.path.join(directory, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fh:
+                fh.write(content)
+
+        config = {
+            "project": {"name": self.name, "description": "Synthetic benchmark project"},
+            "imports": list(imports),
+            "paths": [{"path": "src"}, {"path": "api"}]
+        }
+        with open(os.path.join(directory, "threatspec.yaml"), "w") as fh:
+            yaml.dump(config, fh, default_flow_style=False)
+
+
+def generate(directory, **options):
+    """Writes a project to directory, plus options["imports"] smaller projects in
+    directory/imports that it imports. Returns the full set of options used."""
+    options = dict(DEFAULTS, **{k: v for (k, v) in options.items() if v is not None})
+
+    imports = []
+    for i in range(options["imports"]):
+        name = "import{}".format(i)
+        import_options = dict(options, files=max(1, options["files"] // 10), yaml_files=0)
+        Generator(import_options, name).write(os.path.join(directory, "imports", name))
+        imports.append(os.path.join("imports", name))
+
+    Generator(options, "project").write(directory, imports)
+    return options
@@ -0,0 +1,338 @@
+"""The benchmarks, run from within a corpus directory.
+
+Each benchmark has a setup function, which isn't measured, and a function that
+is given whatever setup returned. Setup runs again before every repetition so
+that each one starts from the same state.
+
+The suite also runs against versions of threatspec from before it was added, so
+anything added to threatspec since then is looked up with hasattr, with a fallback
+that does the same work with the older code.
+"""
+
+import gc
+import os
+import time
+import tempfile
+import tracemalloc
+import collections
+import magic
+from comment_parser import comment_parser
+from threatspec import app, data, parser, reporter, threatmodel
+
+Benchmark = collections.namedtuple("Benchmark", ["name", "setup", "func"])
+
+BENCHMARKS = []
+
+TEXT_TEMPLATE = os.path.join(os.path.dirname(reporter.__file__), "report_templates", "default_text.txt")
+
+# The mime types that later versions give the corpus languages. libmagic, which older
+# versions use, calls many of the generated files text/plain.
+CORPUS_MIME_TYPES = {
+    ".py": "text/x-python",
+    ".rb": "text/x-ruby",
+    ".js": "application/javascript",
+    ".go": "text/x-go",
+    ".java": "text/x-java-source",
+    ".c": "text/x-c"
+}
+
+GRAPHVIZ_STEPS = ["threats", "controls", "components", "mitigations", "acceptances", "exposures", "transfers", "reviews", "connections", "tests"]
+
+
+def benchmark(name, setup=lambda: None):
+    def register(func):
+        BENCHMARKS.append(Benchmark(name, setup, func))
+        return func
+    return register
+
+
+def prepare():
+    """Runs threatspec in each imported project and then in the corpus itself, so
+    that the library and threat model files exist."""
+    project = os.getcwd()
+    for import_path in import_paths(new_app()):
+        os.chdir(import_path)
+        try:
+            new_app().run()
+        finally:
+            os.chdir(project)
+    new_app().run()
+
+
+def import_paths(application):
+    """The absolute paths of the projects imported by the corpus."""
+    paths = []
+    for import_path in application.config.imports:
+        path = data.abs_path(import_path.path)
+        if path != os.getcwd():
+            paths.append(path)
+    return paths
+
+
+def clear_caches():
+    # Caches that would otherwise be warm after the first repetition
+    if hasattr(app, "magic_mime_cache"):
+        app.magic_mime_cache.clear()
+    if hasattr(threatmodel.Library.parse_name, "cache_clear"):
+        threatmodel.Library.parse_name.cache_clear()
+
+
+def detach_defaults(obj):
+    """Older versions use mutable default arguments for the records of the threat model
+    and libraries, so every instance shares them. Gives obj its own empty ones."""
+    defaults = [default for default in type(obj).__init__.__defaults__ or () if isinstance(default, (list, dict))]
+    for (name, value) in list(getattr(obj, "__dict__", {}).items()):
+        if any(value is default for default in defaults):
+            setattr(obj, name, type(value)())
+
+
+def new_app(libraries=False, models=False):
+    clear_caches()
+
+    application = app.ThreatSpecApp()
+    for obj in [application.threatmodel, application.threat_library, application.control_library, application.component_library]:
+        detach_defaults(obj)
+    application.load_local_config()
+    if libraries:
+        application.load_libraries()
+    if models:
+        application.load_threat_models()
+    return application
+
+
+def source_files():
+    application = new_app()
+    if hasattr(application, "source_files"):
+        return list(application.source_files(application.config.paths, os.getcwd()))
+
+    files = []
+    for config_path in application.config.paths:
+        for path in data.recurse_path(data.abs_path(os.getcwd(), config_path.path)):
+            if os.path.isfile(path) and not data.path_ignored(path, config_path.ignore):
+                files.append((path, config_path))
+    return files
+
+
+def get_mime(path):
+    if hasattr(app, "get_mime_for_path"):
+        return app.get_mime_for_path(path)
+    _, ext = os.path.splitext(path)
+    if ext in CORPUS_MIME_TYPES:
+        return CORPUS_MIME_TYPES[ext]
+    return magic.from_file(path, mime=True)
+
+
+loaded = {}
+
+
+def loaded_app():
+    """The fully loaded project, shared by the benchmarks that only read it."""
+    if "app" not in loaded:
+        loaded["app"] = new_app(libraries=True, models=True)
+    return loaded["app"]
+
+
+def report_data():
+    # Report data resolves records as they are read, so each run starts from a new one
+    application = loaded_app()
+    return reporter.DataReporter(application.config.project, application.threatmodel).data
+
+
+def collect_comments():
+    """The comments in the source files, with a parser for their language."""
+    if "comments" not in loaded:
+        loaded["comments"] = []
+        for (path, config_path) in source_files():
+            mime = get_mime(path)
+            if not mime.startswith("text/plain"):
+                with open(path) as fh:
+                    text = fh.read()
+                # parse_comment only returns the annotations, so the model is never used
+                recorder = parser.AnnotationRecorder() if hasattr(parser, "AnnotationRecorder") else threatmodel.ThreatModel()
+                file_parser = parser.CommentParser(recorder, mime)
+                for comment in comment_parser.extract_comments_from_str(text, mime):
+                    loaded["comments"].append((file_parser, comment.text().strip()))
+    return loaded["comments"]
+
+
+def collect_names():
+    """The threat, control and component names used in the annotations."""
+    if "names" not in loaded:
+        loaded["names"] = []
+        for (file_parser, text) in collect_comments():
+            for annotation in file_parser.parse_comment(text):
+                for key in ["threat", "control", "component", "source_component", "destination_component"]:
+                    if key in annotation:
+                        loaded["names"].append(annotation[key])
+    return loaded["names"]
+
+
+@benchmark("parse_source", lambda: new_app(libraries=True))
+def parse_source(application):
+    application.parse_source(application.config.paths, os.getcwd())
+    return getattr(application, "parsed_files", None)
+
+
+@benchmark("parse_comment", collect_comments)
+def parse_comment(comments):
+    for (file_parser, text) in comments:
+        file_parser.parse_comment(text)
+    return len(comments)
+
+
+def uncached_names():
+    clear_caches()
+    return collect_names()
+
+
+@benchmark("parse_name", uncached_names)
+def parse_name(names):
+    library = threatmodel.Library()
+    for name in names:
+        library.parse_name(name)
+    return len(names)
+
+
+@benchmark("library_load", new_app)
+def library_load(application):
+    application.load_libraries()
+    return len(application.threat_library.threats) + len(application.control_library.controls) + len(application.component_library.components)
+
+
+@benchmark("library_save", lambda: new_app(libraries=True))
+def library_save(application):
+    application.save_libraries()
+
+
+@benchmark("model_load", lambda: new_app(libraries=True))
+def model_load(application):
+    application.load_threat_models()
+    if hasattr(application.threatmodel, "source_filenames"):
+        return len(application.threatmodel.source_filenames())
+    return None
+
+
+def local_model():
+    # Only the project's own records, so that saving leaves the corpus unchanged
+    application = new_app(libraries=True)
+    application.load_threat_model(os.getcwd())
+    return application
+
+
+@benchmark("model_save", local_model)
+def model_save(application):
+    application.save_threat_model()
+
+
+@benchmark("build_report", loaded_app)
+def build_report(application):
+    reporter.DataReporter(application.config.project, application.threatmodel)
+
+
+def report_file(suffix):
+    def setup():
+        (fd, filename) = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        return (report_data(), filename)
+    return setup
+
+
+@benchmark("markdown_report", report_file(".md"))
+def markdown_report(args):
+    (report, filename) = args
+    try:
+        reporter.MarkdownReporter(report, loaded_app().config).generate(filename, image=filename + ".png")
+    finally:
+        os.remove(filename)
+
+
+@benchmark("text_report", report_file(".txt"))
+def text_report(args):
+    (report, filename) = args
+    try:
+        reporter.TextReporter(report).generate(filename)
+    finally:
+        os.remove(filename)
+
+
+@benchmark("json_report", report_file(".json"))
+def json_report(args):
+    (report, filename) = args
+    try:
+        reporter.JsonReporter(report).generate(filename)
+    finally:
+        os.remove(filename)
+
+
+@benchmark("template_report", report_file(".txt"))
+def template_report(args):
+    (report, filename) = args
+    try:
+        reporter.TemplateReporter(report).generate(filename, TEXT_TEMPLATE)
+    finally:
+        os.remove(filename)
+
+
+@benchmark("graphviz_dot", report_data)
+def graphviz_dot(report):
+    graphviz = reporter.GraphvizReporter(report)
+    if hasattr(graphviz, "process"):
+        graphviz.process()
+    else:
+        for step in GRAPHVIZ_STEPS:
+            getattr(graphviz, "process_" + step)()
+
+    if hasattr(graphviz, "build_graph"):
+        graph = graphviz.build_graph()
+    else:
+        # Older versions only add the nodes and edges to the graph as it is rendered
+        graph = graphviz.graph
+        for node_id, node in graphviz.nodes.items():
+            graph.dot.node(node_id, node["label"], **node["config"])
+        for source_node_id in graphviz.edges.keys():
+            for destination_node_id, cfg in graphviz.edges[source_node_id].items():
+                graph.dot.edge(source_node_id, destination_node_id, **cfg)
+    return len(graph.dot.source.splitlines())
+
+
+def measure(bench, repeat=5):
+    """Returns the minimum and median wall time of the benchmark over repeat runs, and
+    the peak memory allocated by one further run, traced separately as tracing slows
+    everything down."""
+    times = []
+    items = None
+    for i in range(repeat):
+        state = bench.setup()
+        gc.collect()
+        start = time.perf_counter()
+        items = bench.func(state)
+        times.append(time.perf_counter() - start)
+
+    state = bench.setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        bench.func(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "repeat": repeat,
+        "peak_memory": peak,
+        "items": items
+    }
+
+
+def run(selected=None, repeat=5, callback=None):
+    results = {}
+    for bench in BENCHMARKS:
+        if selected and bench.name not in selected:
+            continue
+        results[bench.name] = measure(bench, repeat)
+        if callback:
+            callback(bench.name, results[bench.name])
+    return results
@@ -17,7 +17,7 @@ setup(
         'pyyaml',
         'jsonschema',
         'jinja2',
-        'comment_parser'
+        'comment_parser>=1.2.0'
     ],
     use_scm_version=True,
     setup_requires=[
@@ -0,0 +1,23 @@
+import pytest
+from threatspec import threatmodel, reporter
+
+
+@pytest.fixture(autouse=True)
+def user_cache_dir(tmp_path, monkeypatch):
+    """Keeps the user cache, e.g. compiled templates, inside the test's directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "user_cache"))
+    yield tmp_path / "user_cache"
+    reporter.bytecode_cache = None
+    reporter.template_environment.cache_clear()
+
+
+@pytest.fixture
+def new_threatmodel():
+    """Returns a function creating an empty threat model with its own libraries."""
+    def new(run_id="run_id"):
+        t = threatmodel.ThreatModel([], [], [], [], [], [], [], run_id)
+        t.threat_library = threatmodel.ThreatLibrary({})
+        t.control_library = threatmodel.ControlLibrary({})
+        t.component_library = threatmodel.ComponentLibrary({})
+        return t
+    return new
@@ -0,0 +1,248 @@
+import pytest
+import os
+import json
+import shutil
+import subprocess
+import time
+from threatspec import app, config, parser, reporter, threatmodel
+
+
+def test_report_outputs():
+    threatspec = app.ThreatSpecApp()
+    assert threatspec.report_outputs(["markdown"]) == [("markdown", "ThreatModel.md")]
+    assert threatspec.report_outputs(["Text,json:report.json", "template:out.html"]) == [
+        ("text", "ThreatModel.txt"),
+        ("json", "report.json"),
+        ("template", "out.html")
+    ]
+    assert threatspec.report_outputs(["json"], "model.json") == [("json", "model.json")]
+
+    with pytest.raises(SystemExit):
+        threatspec.report_outputs(["text,json"], "report")
+    with pytest.raises(SystemExit):
+        threatspec.report_outputs(["pdf"])
+
+
+
+def test_get_mime_for_path(monkeypatch):
+    def sniff_mime(path, content=None):
+        raise AssertionError("libmagic used for {}".format(path))
+    monkeypatch.setattr(app, "sniff_mime", sniff_mime)
+
+    assert app.get_mime_for_path("/src/Dockerfile") == "text/x-shellscript"
+    assert app.get_mime_for_path("/src/app.py") == "text/x-python"
+    assert app.get_mime_for_path("/src/App.JSX") == "application/javascript"
+    assert app.get_mime_for_path("/src/api.YAML") == "text/plain"
+
+
+def test_get_mime_for_path_magic_memoized(monkeypatch):
+    sniffed = []
+    def sniff_mime(path, content=None):
+        sniffed.append(path)
+        return "text/x-lua"
+    monkeypatch.setattr(app, "sniff_mime", sniff_mime)
+    monkeypatch.setattr(app, "magic_mime_cache", {})
+
+    # libmagic runs once per directory and extension, and always for files without one
+    assert app.get_mime_for_path("/src/a.lua") == "text/x-lua"
+    assert app.get_mime_for_path("/src/b.lua") == "text/x-lua"
+    assert app.get_mime_for_path("/src/C.LUA") == "text/x-lua"
+    assert app.get_mime_for_path("/lib/c.lua") == "text/x-lua"
+    assert app.get_mime_for_path("/src/script") == "text/x-lua"
+    assert app.get_mime_for_path("/src/other") == "text/x-lua"
+    assert sniffed == ["/src/a.lua", "/lib/c.lua", "/src/script", "/src/other"]
+
+
+def test_get_parser_for_path_mime_override(monkeypatch):
+    monkeypatch.setattr(app, "sniff_mime", lambda path, content=None: "text/x-lua")
+    t = threatmodel.ThreatModel()
+
+    path = config.Path({"path": "src", "extensions": {"TXT": "text/x-python"}})
+    file_parser = app.get_parser_for_path(t, "src/notes.txt", path)
+    assert isinstance(file_parser, parser.SourceFileParser) and file_parser.mime == "text/x-python"
+    assert isinstance(app.get_parser_for_path(t, "src/api.yaml", path), parser.YamlFileParser)
+
+    path = config.Path({"path": "src", "mime": "text/x-c"})
+    assert app.get_parser_for_path(t, "src/app.py", path).mime == "text/x-c"
+    assert app.get_parser_for_path(t, "src/app.lua", config.Path("src")).mime == "text/x-lua"
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_run_since_yaml_source(tmp_path, monkeypatch):
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=str(tmp_path), check=True, stdout=subprocess.PIPE)
+
+    def mitigations():
+        with open(str(tmp_path / "threatmodel" / "threatmodel.json")) as fh:
+            return [(m["control"], m["source"]["filename"]) for m in json.load(fh)["mitigations"]]
+
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+    (tmp_path / "api.yaml").write_text('api:\n  x-threatspec: "@mitigates App:Api against XSS with Escaping"\n')
+    app.ThreatSpecApp().run()
+    assert mitigations() == [("#escaping", "api.yaml")]
+
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-q", "-m", "initial")
+
+    # YAML records have relative filenames, so the old ones must still be replaced
+    (tmp_path / "api.yaml").write_text('api:\n  x-threatspec: "@mitigates App:Api against XSS with Encoding"\n')
+    app.ThreatSpecApp().run(since="HEAD")
+    assert mitigations() == [("#encoding", "api.yaml")]
+
+
+def test_load_imports_with_jobs(tmp_path, monkeypatch):
+    for (name, code) in [("one", "# @exposes App:Web to XSS with input\n# @review App:Web one\n"), ("two", "# @exposes App:Web to XSS with form\n# @review App:Api two\n")]:
+        (tmp_path / name).mkdir()
+        monkeypatch.chdir(str(tmp_path / name))
+        app.ThreatSpecApp().init()
+        (tmp_path / name / "app.py").write_text(code)
+        app.ThreatSpecApp().run()
+
+    (tmp_path / "main").mkdir()
+    monkeypatch.chdir(str(tmp_path / "main"))
+    app.ThreatSpecApp().init()
+    config_file = tmp_path / "main" / "threatspec.yaml"
+    config_file.write_text(config_file.read_text().replace("imports:", "imports:\n  - '../two'\n  - '../one'", 1))
+
+    process_pools = []
+    class ProcessPoolExecutor(app.concurrent.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            process_pools.append(self)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(app.concurrent.futures, "ProcessPoolExecutor", ProcessPoolExecutor)
+
+    def load(jobs):
+        threatspec = app.ThreatSpecApp()
+        threatspec.load_local_config()
+        threatspec.load_libraries(jobs)
+        threats = [(threat_id, threat.run_id) for (threat_id, threat) in threatspec.threat_library.threats.items()]
+        threatspec.load_threat_models(jobs)
+        assert threatspec.prefetched_files == {}
+        return (
+            threats,
+            [(review.component, review.details) for review in threatspec.threatmodel.reviews],
+            [exposure.details for exposure in threatspec.threatmodel.exposures]
+        )
+
+    # A few files are read by threads even with several jobs
+    expected = load(1)
+    assert load(2) == expected
+    assert process_pools == []
+
+    monkeypatch.setattr(app, "PREFETCH_PROCESS_THRESHOLD", 1)
+    assert load(2) == expected
+    assert len(process_pools) == 2
+
+    # The first import listed wins, and records are merged in import order
+    with open(str(tmp_path / "two" / "threatmodel" / "threats.json")) as fh:
+        assert expected[0] == [("#xss", json.load(fh)["threats"]["#xss"]["run_id"])]
+    assert expected[1] == [("#app_api", "two"), ("#app_web", "one")]
+    assert expected[2] == ["form", "input"]
+
+
+def test_ndjson_threat_model(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+    (tmp_path / "app.py").write_text("# @exposes App:Web to XSS with input\n# @review App:Web check\n")
+    app.ThreatSpecApp().run(model_format="ndjson")
+    assert not (tmp_path / "threatmodel" / "threatmodel.json").exists()
+    assert not (tmp_path / "threatmodel" / "threatmodel.ndjson.tmp").exists()
+
+    threatspec = app.ThreatSpecApp()
+    threatspec.load_local_config()
+    threatspec.load_libraries()
+    threatspec.load_threat_models()
+    assert [(e.threat, e.details) for e in threatspec.threatmodel.exposures] == [("#xss", "input")]
+    assert [r.details for r in threatspec.threatmodel.reviews] == ["check"]
+
+    ndjson = tmp_path / "threatmodel" / "threatmodel.ndjson"
+    valid = ndjson.read_text()
+    for invalid in ['{"kind": "exposure", "threat": 1}', '{"kind": "unknown"}', '{"kind": ']:
+        ndjson.write_text(valid + invalid + "\n")
+        threatspec = app.ThreatSpecApp()
+        with pytest.raises(SystemExit) as e:
+            threatspec.load_threat_models()
+        assert e.value.code == 1
+
+
+def test_ndjson_run_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+
+    threatspec = app.ThreatSpecApp()
+    def parse_source(*args):
+        raise RuntimeError("parsing failed")
+    monkeypatch.setattr(threatspec, "parse_source", parse_source)
+    with pytest.raises(RuntimeError):
+        threatspec.run(model_format="ndjson")
+
+    # The partly written model is closed and removed, and nothing else is replaced
+    assert threatspec.threatmodel.stream is None
+    assert os.listdir(str(tmp_path / "threatmodel")) == []
+
+
+def test_report_several_outputs(tmp_path, monkeypatch, user_cache_dir):
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(reporter.Digraph, "pipe", lambda self: self.source.encode("utf-8"))
+    app.ThreatSpecApp().init()
+    (tmp_path / "app.py").write_text("# @exposes App:Web to XSS with input\n")
+    app.ThreatSpecApp().run()
+
+    threatspec = app.ThreatSpecApp()
+    loads = []
+    load_threat_models = threatspec.load_threat_models
+    def count_loads(jobs=1):
+        loads.append(jobs)
+        load_threat_models(jobs)
+    monkeypatch.setattr(threatspec, "load_threat_models", count_loads)
+
+    threatspec.report(["markdown,json:x.json,text"])
+    assert loads == [1]
+    # Compiled templates are specific to the machine, so they are kept out of the project
+    assert not (tmp_path / "threatmodel" / "template_cache").exists()
+    assert list((user_cache_dir / "threatspec" / "template_cache").iterdir())
+    assert "XSS" in (tmp_path / "ThreatModel.md").read_text()
+    assert (tmp_path / "ThreatModel.md.png").exists()
+    with open(str(tmp_path / "x.json")) as fh:
+        assert [exposure["threat"]["name"] for exposure in json.load(fh)["threatmodel"]["exposures"]] == ["XSS"]
+    assert "threatspec project Threat Model" in (tmp_path / "ThreatModel.txt").read_text()
+
+    # A failure in one of the concurrently written reports isn't lost
+    def generate(self, filename):
+        raise IOError("disk full")
+    monkeypatch.setattr(reporter.TextReporter, "generate", generate)
+    with pytest.raises(IOError, match="disk full"):
+        app.ThreatSpecApp().report(["markdown,json:x.json,text"])
+
+
+def test_run_skips_json_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+    # Tabs aren't valid YAML indentation, and the package name looks like an annotation
+    (tmp_path / "package.json").write_text('{\n\t"name": "web",\n\t"devDependencies": {\n\t\t"@testing-library/react": "^14.0.0"\n\t}\n}\n')
+    (tmp_path / "app.py").write_text("# @exposes App:Web to XSS with input\n")
+    app.ThreatSpecApp().run()
+
+    with open(str(tmp_path / "threatmodel" / "threatmodel.json")) as fh:
+        assert [e["source"]["filename"] for e in json.load(fh)["exposures"]] == [str(tmp_path / "app.py")]
+
+
+def test_report_two_markdown_outputs(tmp_path, monkeypatch):
+    def pipe(self):
+        # Long enough for the other report to load the manifest in the meantime
+        time.sleep(0.1)
+        return self.source.encode("utf-8")
+    monkeypatch.setattr(reporter.Digraph, "pipe", pipe)
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+    (tmp_path / "app.py").write_text("# @exposes App:Web to XSS with input\n")
+    app.ThreatSpecApp().run()
+
+    app.ThreatSpecApp().report(["markdown:a.md,markdown:b.md"])
+    with open(str(tmp_path / "threatmodel" / "diagrams.json")) as fh:
+        manifest = json.load(fh)
+    assert sorted(manifest) == ["a.md.png", "b.md.png"]
+    cached = os.listdir(str(tmp_path / "threatmodel" / "diagram_cache"))
+    assert cached == ["{}.png".format(manifest["a.md.png"])]
@@ -0,0 +1,49 @@
+import pytest
+import os
+from threatspec import cache
+
+
+def test_source_cache_hit_and_miss(tmp_path):
+    source_file = tmp_path / "source.js"
+    source_file.write_text("// @review Path:To:Component check this\n")
+    path = str(source_file)
+    records = [({"action": "review", "component": "Path:To:Component", "details": "check this"}, {"filename": path, "line": 1})]
+
+    c = cache.SourceCache()
+    assert c.get(path, ["", 5]) is None
+    c.set(path, ["", 5], records)
+    c.save(str(tmp_path), "cache.json")
+
+    c = cache.SourceCache()
+    c.load(str(tmp_path), "cache.json")
+    assert c.get(path, ["text/x-c", 5]) is None
+    assert c.get(path, ["", 5]) == [[records[0][0], records[0][1]]]
+    assert c.hits == 1
+    assert c.misses == 1
+
+    # Same content with a new modification time is still a hit
+    os.utime(path, ns=(0, 0))
+    assert c.get(path, ["", 5]) is not None
+
+    source_file.write_text("// @review Path:To:Component check that\n")
+    assert c.get(path, ["", 5]) is None
+
+
+def test_source_cache_drops_unused_entries(tmp_path):
+    for name in ["a.txt", "b.txt"]:
+        (tmp_path / name).write_text(name)
+
+    c = cache.SourceCache()
+    c.set(str(tmp_path / "a.txt"), ["", 5], [])
+    c.set(str(tmp_path / "b.txt"), ["", 5], [])
+    c.save(str(tmp_path), "cache.json")
+
+    os.remove(str(tmp_path / "b.txt"))
+    c = cache.SourceCache()
+    c.load(str(tmp_path), "cache.json")
+    assert c.get(str(tmp_path / "a.txt"), ["", 5]) == []
+    c.save(str(tmp_path), "cache.json")
+
+    c = cache.SourceCache()
+    c.load(str(tmp_path), "cache.json")
+    assert list(c.entries.keys()) == [str(tmp_path / "a.txt")]
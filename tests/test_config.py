@@ -0,0 +1,27 @@
+import pytest
+from threatspec import config
+
+
+def test_path_get_mime():
+    path = config.Path({"path": "src", "extensions": {"vue": "application/javascript", ".PYW": "text/x-python"}})
+    assert path.get_mime("src/app.vue") == "application/javascript"
+    assert path.get_mime("src/app.pyw") == "text/x-python"
+    assert path.get_mime("src/app.go") == ""
+
+    path = config.Path({"path": "src", "mime": "text/x-c", "extensions": {"vue": "application/javascript"}})
+    assert path.get_mime("src/app.vue") == "text/x-c"
+
+    path = config.Path("src")
+    assert path.get_mime("src/app.go") == ""
+
+
+def test_path_context_lines():
+    assert config.Path("src").context_lines == 5
+    assert config.Path({"path": "src", "context_lines": 10}).context_lines == 10
+    assert config.Path({"path": "src", "context_lines": 10}).get_options("src/app.go") == ["", 10]
+
+    assert config.Path({"path": "src", "context_lines": 0}).context_lines == 0
+
+    for invalid in [-1, True, "5", 2.5]:
+        with pytest.raises(ValueError, match="non-negative integer"):
+            config.Path({"path": "src", "context_lines": invalid})
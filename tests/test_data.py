@@ -0,0 +1,103 @@
+import pytest
+import os
+import json
+from threatspec import data
+
+
+def test_recurse_path(tmp_path):
+    for name in ["a.py", "sub/b.py", "sub/deeper/c.py", "node_modules/lib/d.js", ".git/e.py", "sub/.hidden.py"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    root = str(tmp_path)
+
+    files = [os.path.relpath(path, root) for path in data.recurse_path(root, ["node_modules"])]
+    assert sorted(files) == ["a.py", os.path.join("sub", "b.py"), os.path.join("sub", "deeper", "c.py")]
+    assert files.index(os.path.join("sub", "b.py")) < files.index(os.path.join("sub", "deeper", "c.py"))
+
+    assert list(data.recurse_path(os.path.join(root, "a.py"))) == [os.path.join(root, "a.py")]
+    assert list(data.recurse_path(os.path.join(root, "sub", "*.py"))) == [os.path.join(root, "sub", "b.py")]
+
+
+def test_select_paths(tmp_path):
+    for name in ["a.py", "sub/b.py", "node_modules/c.js", ".github/d.py", "other.txt"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    root = str(tmp_path)
+    changed = [os.path.join(os.path.realpath(root), *name.split("/")) for name in ["sub/b.py", "a.py", "node_modules/c.js", ".github/d.py", "deleted.py"]]
+
+    assert list(data.select_paths(changed, root, ["node_modules"])) == [os.path.join(root, "a.py"), os.path.join(root, "sub", "b.py")]
+    assert list(data.select_paths(changed, os.path.join(root, "sub"))) == [os.path.join(root, "sub", "b.py")]
+    assert list(data.select_paths(changed, os.path.join(root, "*.py"))) == [os.path.join(root, "a.py")]
+    assert list(data.select_paths(changed, os.path.join(root, "other.txt"))) == []
+
+
+def test_recurse_directories(tmp_path):
+    for name in ["a.py", "sub/deeper/b.py", "node_modules/lib/c.js", ".git/d.py"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    (tmp_path / "empty").mkdir()
+    root = str(tmp_path)
+
+    directories = [os.path.relpath(path, root) for path in data.recurse_directories(root, ["node_modules"])]
+    assert sorted(directories) == [os.curdir, "empty", "sub", os.path.join("sub", "deeper")]
+    assert list(data.recurse_directories(os.path.join(root, "a.py"))) == [root]
+
+    # The same directories are selected without walking
+    (tmp_path / "build").mkdir()
+    (tmp_path / ".gitignore").write_text("build/\n")
+    for directory in directories:
+        assert data.directory_selected(os.path.join(root, directory), root, ["node_modules"])
+    for directory in ["node_modules", os.path.join("node_modules", "lib"), ".git", os.pardir]:
+        assert not data.directory_selected(os.path.normpath(os.path.join(root, directory)), root, ["node_modules"])
+    assert data.directory_selected(os.path.join(root, "build"), root)
+    assert not data.directory_selected(os.path.join(root, "build"), root, gitignore=True)
+    assert data.directory_selected(os.path.join(root, "sub"), os.path.join(root, "*", "*.py"))
+    assert data.directory_selected(root, os.path.join(root, "a.py"))
+    assert not data.directory_selected(os.path.join(root, "sub"), os.path.join(root, "a.py"))
+
+
+def test_user_cache_dir(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", "/xdg")
+    assert data.user_cache_dir("templates") == os.path.join("/xdg", "threatspec", "templates")
+
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", "/home/user")
+    assert data.user_cache_dir() == os.path.join("/home/user", ".cache", "threatspec")
+
+
+def test_read_validated_json(tmp_path):
+    schema = os.path.join("data", "threats_schema.json")
+    threat = {"id": "#xss", "run_id": "run_id", "name": "XSS", "description": ""}
+    filename = str(tmp_path / "threats.json")
+
+    assert data.read_validated_json(filename, schema) == (None, None)
+
+    with open(filename, "w") as fh:
+        json.dump({"threats": {"#xss": threat}}, fh)
+    assert data.read_validated_json(filename, schema) == ({"threats": {"#xss": threat}}, None)
+
+    with open(filename, "w") as fh:
+        fh.write('{"threats": {')
+    (document, error) = data.read_validated_json(filename, schema)
+    assert document is None and error
+
+    with open(filename, "w") as fh:
+        json.dump({"threats": {"#xss": {"id": "#xss"}}}, fh)
+    (document, error) = data.read_validated_json(filename, schema)
+    assert document is None and "required" in error
+
+
+def test_schema_validator_cached(tmp_path):
+    schema = os.path.join("data", "controls_schema.json")
+    filename = str(tmp_path / "controls.json")
+    with open(filename, "w") as fh:
+        json.dump({"controls": {}}, fh)
+
+    data.schema_validator.cache_clear()
+    for i in range(3):
+        assert data.read_validated_json(filename, schema) == ({"controls": {}}, None)
+    assert data.schema_validator(schema, None) is data.schema_validator(schema, None)
+    assert data.schema_validator.cache_info().misses == 1
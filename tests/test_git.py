@@ -0,0 +1,26 @@
+import pytest
+import os
+import shutil
+import subprocess
+from threatspec import git
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_changed_files(tmp_path):
+    def run(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=str(tmp_path), check=True, stdout=subprocess.PIPE)
+
+    run("init", "-q")
+    for name in ["a.py", "b.py", "c.py"]:
+        (tmp_path / name).write_text(name)
+    run("add", "-A")
+    run("commit", "-q", "-m", "initial")
+
+    (tmp_path / "a.py").write_text("changed")
+    (tmp_path / "b.py").unlink()
+    (tmp_path / "d.py").write_text("new")
+    root = os.path.realpath(str(tmp_path))
+    assert git.changed_files(str(tmp_path), "HEAD") == set(os.path.join(root, name) for name in ["a.py", "b.py", "d.py"])
+
+    with pytest.raises(git.GitError):
+        git.changed_files(str(tmp_path), "no-such-revision")
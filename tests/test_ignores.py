@@ -0,0 +1,57 @@
+import pytest
+import os
+from threatspec import data, ignores
+
+
+def match(patterns, path, is_dir=False):
+    base = os.path.join(os.sep, "repo")
+    return ignores.IgnoreMatcher(patterns, base).ignored(os.path.join(base, *path.split("/")), is_dir)
+
+
+def test_ignore_patterns():
+    assert match(["test"], "test")
+    assert match(["test"], "src/test", True)
+    assert not match(["test"], "latest.go")
+    assert not match(["test"], "tests/a.py")
+
+    assert match(["*.js"], "src/app.js")
+    assert not match(["/*.js"], "src/app.js")
+    assert match(["/*.js"], "app.js")
+    assert match(["src/*.js"], "src/app.js")
+    assert not match(["src/*.js"], "lib/src/app.js")
+
+    assert match(["build/"], "build", True)
+    assert not match(["build/"], "build")
+
+    assert match(["**/foo/bar"], "a/b/foo/bar", True)
+    assert match(["lib/**/baz.c"], "lib/baz.c")
+    assert match(["lib/**/baz.c"], "lib/x/y/baz.c")
+    assert match(["out/**"], "out/a/b.js")
+    assert not match(["out/**"], "out", True)
+
+    assert match(["x/a[bc]?.log"], "x/abz.log")
+    assert not match(["x/a[!bc]?.log"], "x/abz.log")
+    assert match(["\\!important.txt"], "!important.txt")
+    assert not match(["# comment", ""], "# comment")
+
+    assert not match(["*.log", "!keep.log"], "keep.log")
+    assert match(["!keep.log", "*.log"], "keep.log")
+
+
+def test_recurse_path_gitignore(tmp_path):
+    for name in ["a.py", "b.log", "sub/c.py", "sub/d.py", "build/e.py", "keep/f.log"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("*.log\n/build/\n!keep/*.log\n")
+    (tmp_path / "sub" / ".gitignore").write_text("c.py\n")
+    root = str(tmp_path)
+
+    files = sorted(os.path.relpath(path, root) for path in data.recurse_path(root, ["d.py"], gitignore=True))
+    assert files == ["a.py", os.path.join("keep", "f.log")]
+
+    files = sorted(os.path.relpath(path, root) for path in data.recurse_path(root, ["d.py"]))
+    assert len(files) == 5
+
+    assert list(data.recurse_path(os.path.join(root, "sub", "*.py"), gitignore=True)) == [os.path.join(root, "sub", "d.py")]
@@ -217,3 +217,80 @@ def test_yaml_paser():
 
     assert "#extended_threat_1" in t.threat_library.threats
     assert t.threat_library.threats["#extended_threat_1"].custom["impact"] == "high"
+
+
+def test_annotation_recorder_replay(new_threatmodel):
+    recorder = parser.AnnotationRecorder()
+    p = parser.SourceFileParser(recorder)
+    source = {"annotation": "", "code": "", "filename": "path/to/file", "line": 1}
+
+    for data in p.parse_comment("@mitigates Path:To:Component against A Threat with A Control\n@tests A Control for Path:To:Component"):
+        source["line"] = data.pop("line")
+        source["annotation"] = data.pop("annotation")
+        p.run_action(data, source)
+
+    assert len(recorder.records) == 2
+    assert recorder.records[0][0]["action"] == "mitigate"
+    assert recorder.records[0][1]["line"] == 1
+    assert recorder.records[1][1]["line"] == 2
+
+    t = new_threatmodel()
+    replay = parser.Parser(t)
+    for (data, source) in recorder.records:
+        replay.run_action(data, source)
+
+    assert len(t.mitigations) == 1
+    assert t.mitigations[0].control == "#a_control"
+    assert t.mitigations[0].source.line == 1
+    assert len(t.tests) == 1
+    assert "#path_to_component" in t.component_library.components
+
+
+def test_read_source(tmp_path, monkeypatch):
+    annotated = tmp_path / "annotated.py"
+    annotated.write_bytes(b"x = 1\r\n# @review Path:To:Component check this\r\n")
+    plain = tmp_path / "plain.py"
+    plain.write_bytes(b"# email@example.com\nx = 1\n")
+    empty = tmp_path / "empty.py"
+    empty.write_bytes(b"")
+    assert parser.read_source(str(empty)) is None
+
+    for threshold in [parser.MMAP_THRESHOLD, 0]:
+        monkeypatch.setattr(parser, "MMAP_THRESHOLD", threshold)
+        content = parser.read_source(str(annotated))
+        assert content == annotated.read_bytes()
+        assert parser.decode_source(content) == "x = 1\n# @review Path:To:Component check this\n"
+        assert parser.read_source(str(plain)) is None
+
+
+def test_annotation_matcher():
+    assert parser.matcher.action("@mitigates A:B against C with D") == "mitigate"
+    assert parser.matcher.action("@tests A Control for A:B") == "test"
+    assert parser.matcher.action("@threat A Threat") == "threat"
+    assert parser.matcher.action("not @threat A Threat") is None
+    assert parser.matcher.action("@unknown thing") is None
+
+    m = parser.matcher.match("test", "@tests A Control for A:B")
+    assert m.groupdict() == {"control": "A Control", "component": "A:B"}
+    assert parser.matcher.match("mitigate", "@mitigated A:B") is None
+
+
+def test_yaml_parse_annotation_returns_new_dict():
+    t = threatmodel.ThreatModel()
+    p = parser.YamlFileParser(t)
+
+    first = p.parse_annotation("@threat First threat")
+    second = p.parse_annotation("@threat Second threat")
+    assert first is not second
+    assert first["threat"] == "First threat"
+
+
+def test_extract_comment_context():
+    t = threatmodel.ThreatModel()
+    p = parser.SourceFileParser(t)
+    lines = ["// @review A:B check\n", "a = 1\n", "// other\n", "b = 2\n", "c = 3\n", "d = 4\n"]
+
+    assert p.extract_comment_context(lines, {1, 3}, 1, 2) == "// @review A:B check\na = 1\nb = 2\n"
+    assert p.extract_comment_context(lines, {1, 3}, 1, 10) == "// @review A:B check\na = 1\nb = 2\nc = 3\nd = 4\n"
+    assert p.extract_comment_context(lines, {1, 3}, 2, 1, multiline=True) == "a = 1\n"
+    assert p.extract_comment_context(lines, {1, 3}, 7, 5) == ""
@@ -0,0 +1,35 @@
+import pytest
+from threatspec import profiling
+
+
+def test_profiler_phases():
+    profiler = profiling.Profiler()
+    with profiler.phase("ignored"):
+        pass
+    assert profiler.phases == {}
+
+    profiler.enable()
+    with profiler.phase("outer"):
+        with profiler.phase("inner", 3):
+            pass
+        with profiler.phase("inner", 2):
+            pass
+    assert list(profiler.phases.keys()) == ["outer", "inner"]
+    assert profiler.phases["inner"].calls == 2
+    assert profiler.phases["inner"].items == 5
+    assert profiler.phases["outer"].wall >= 0
+
+    profiler.file("b.py", 0.2)
+    profiler.file("a.py", 0.5)
+    profiler.file("c.py", 0.1)
+    assert profiler.slowest_files(2) == [(0.5, "a.py"), (0.2, "b.py")]
+    assert [f["filename"] for f in profiler.trace(1)["slowest_files"]] == ["a.py"]
+    assert "inner" in profiler.summary()
+
+
+def test_timed(monkeypatch):
+    profiler = profiling.Profiler()
+    profiler.enable()
+    monkeypatch.setattr(profiling, "profiler", profiler)
+    assert list(profiling.timed("walk", ["a", "b"])) == ["a", "b"]
+    assert profiler.phases["walk"].items == 2
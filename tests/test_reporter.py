@@ -1,7 +1,153 @@
 import pytest
-from threatspec import threatmodel, reporter
+from threatspec import threatmodel, reporter, config
+import json
+import re
 
 def test_code_function():
     assert reporter.code("a line of code") == "a line of code"
     assert reporter.code("   a line of code") == "a line of code"
-    assert reporter.code("  a first line\n    second line") == "a first line\n  second line"
\ No newline at end of file
+    assert reporter.code("  a first line\n    second line") == "a first line\n  second line"
+
+def test_report_data_view(new_threatmodel):
+    t = new_threatmodel()
+    source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+    t.add_mitigation({"control": "A Control", "threat": "A Threat", "component": "A:Component"}, dict(source))
+    t.add_exposure({"threat": "B Threat", "component": "A:Component", "details": "details"}, dict(source))
+    t.add_test({"control": "A Control", "component": "A:Component"}, dict(source))
+
+    report = reporter.DataReporter(config.Project("name", "description"), t).data
+
+    mitigation = report["threatmodel"]["mitigations"][0]
+    assert mitigation["threat"]["name"] == "A Threat"
+    assert mitigation.control.id == "#a_control"
+    assert mitigation["source"]["code"] == "code"
+    assert len(mitigation["tests"]) == 1
+    assert mitigation["tests"][0]["component"]["name"] == "A:Component"
+    assert "tests" not in mitigation["tests"][0]
+    assert report["threatmodel"]["exposures"][0]["tests"] == []
+    assert list(report["threats"].keys()) == ["#a_threat", "#b_threat"]
+    assert list(report["components"].keys()) == ["#a_component"]
+
+    data = json.loads(json.dumps(report, default=reporter.json_default))
+    assert data["threatmodel"]["mitigations"][0]["control"] == t.control_library.controls["#a_control"].as_dict()
+    assert data["threatmodel"]["mitigations"][0]["source"] == source
+    assert data["threatmodel"]["run_id"] == "run_id"
+
+def test_template_environment(tmp_path):
+    assert reporter.template_environment() is reporter.template_environment()
+    assert reporter.template_environment().get_template("default_text.txt") is reporter.template_environment().get_template("default_text.txt")
+
+    reporter.set_template_cache(str(tmp_path), "cache")
+    reporter.template_environment().get_template("default_text.txt")
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    # A cache that can't be created is skipped rather than failing the report
+    (tmp_path / "file").write_text("")
+    reporter.set_template_cache(str(tmp_path), "file", "cache")
+    assert reporter.template_environment().get_template("default_text.txt")
+
+def test_template_reporter_custom_template(tmp_path, new_threatmodel):
+    t = new_threatmodel()
+    source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+    t.add_mitigation({"control": "A Control", "threat": "A Threat", "component": "A:Component"}, dict(source))
+    t.add_exposure({"threat": "B Threat", "component": "A:Component", "details": "details"}, dict(source))
+    report = reporter.DataReporter(config.Project("Project", "Description"), t)
+
+    template = tmp_path / "custom.json"
+    template.write_text("""{
+  "records": {{ (report.threatmodel.mitigations + report.threatmodel.exposures) | length }},
+  "listed": {{ ([] + report.threatmodel.exposures) | length }},
+  "mitigations": {{ report.threatmodel.mitigations | tojson }},
+  "project": {{ report.project | tojson }}
+}""")
+    filename = str(tmp_path / "ThreatModel.json")
+    reporter.TemplateReporter(report.data).generate(filename, str(template))
+
+    data = json.load(open(filename))
+    assert data["records"] == 2
+    assert data["listed"] == 1
+    assert data["mitigations"][0]["threat"]["name"] == "A Threat"
+    assert data["mitigations"][0]["source"] == source
+    assert data["project"] == {"name": "Project", "description": "Description"}
+
+def test_text_reporter_stream(tmp_path, new_threatmodel):
+    t = new_threatmodel()
+    report = reporter.DataReporter(config.Project("Project", "Description"), t)
+
+    filename = str(tmp_path / "ThreatModel.txt")
+    reporter.TextReporter(report.data).generate(filename)
+    assert "Project Threat Model" in open(filename).read()
+    assert [p.name for p in tmp_path.iterdir()] == ["ThreatModel.txt"]
+
+def test_graphviz_split_diagrams(tmp_path, monkeypatch, new_threatmodel):
+    rendered = []
+    def pipe(self):
+        rendered.append(self.source)
+        return self.source.encode("utf-8")
+    monkeypatch.setattr(reporter.Digraph, "pipe", pipe)
+
+    t = new_threatmodel()
+    for component in ["App:Web", "App:Db", "Other"]:
+        source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+        t.add_mitigation({"threat": "XSS", "control": "Escaping", "component": component}, source)
+    report = reporter.DataReporter(config.Project("Project", "Description"), t)
+
+    filename = str(tmp_path / "ThreatModel.md")
+    manifest = str(tmp_path / "diagrams.json")
+    gv = reporter.GraphvizReporter(report.data, split=True, manifest=manifest)
+    files = gv.generate(filename)
+    assert files == [filename + ".app.png", filename + ".other.png"]
+    assert len(rendered) == 2
+    assert len(set(re.findall(r"mitigation_\w+", rendered[0]))) == 2 and "Other" not in rendered[0]
+    assert len(set(re.findall(r"mitigation_\w+", rendered[1]))) == 1 and "App" not in rendered[1]
+
+    # The DOT source is the same for the same model, so nothing is rendered again
+    gv = reporter.GraphvizReporter(report.data, split=True, manifest=manifest)
+    assert gv.generate(filename) == files
+    assert len(rendered) == 2
+
+def test_graphviz_diagram_cache(tmp_path, monkeypatch, new_threatmodel):
+    rendered = []
+    def pipe(self):
+        rendered.append(self.source)
+        return self.source.encode("utf-8")
+    monkeypatch.setattr(reporter.Digraph, "pipe", pipe)
+
+    t = new_threatmodel()
+    source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+    t.add_mitigation({"threat": "XSS", "control": "Escaping", "component": "App"}, source)
+    report = reporter.DataReporter(config.Project("Project", "Description"), t)
+
+    cache_dir = str(tmp_path / "cache")
+    reporter.GraphvizReporter(report.data, cache_dir=cache_dir).generate(str(tmp_path / "First.md"))
+    reporter.GraphvizReporter(report.data, cache_dir=cache_dir).generate(str(tmp_path / "Second.md"))
+    assert len(rendered) == 1
+    assert (tmp_path / "Second.md.png").read_bytes() == (tmp_path / "First.md.png").read_bytes()
+
+    reporter.GraphvizReporter(report.data).generate(str(tmp_path / "Third.md"))
+    assert len(rendered) == 2
+
+def test_graphviz_diagram_cache_pruned(tmp_path, monkeypatch, new_threatmodel):
+    monkeypatch.setattr(reporter.Digraph, "pipe", lambda self: self.source.encode("utf-8"))
+
+    def report_data(component):
+        t = new_threatmodel()
+        source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+        t.add_mitigation({"threat": "XSS", "control": "Escaping", "component": component}, source)
+        return reporter.DataReporter(config.Project("Project", "Description"), t).data
+
+    manifest = str(tmp_path / "diagrams.json")
+    cache_dir = tmp_path / "cache"
+    reporter.GraphvizReporter(report_data("App"), manifest=manifest, cache_dir=str(cache_dir)).generate(str(tmp_path / "First.md"))
+    reporter.GraphvizReporter(report_data("Web"), manifest=manifest, cache_dir=str(cache_dir)).generate(str(tmp_path / "Second.md"))
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # Only the images of the current diagrams are kept
+    reporter.GraphvizReporter(report_data("Db"), manifest=manifest, cache_dir=str(cache_dir)).generate(str(tmp_path / "First.md"))
+    assert sorted(path.name.split(".")[0] for path in cache_dir.iterdir()) == sorted(set(json.loads((tmp_path / "diagrams.json").read_text()).values()))
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # The images of deleted reports are removed too
+    (tmp_path / "Second.md.png").unlink()
+    reporter.GraphvizReporter(report_data("Db"), manifest=manifest, cache_dir=str(cache_dir)).generate(str(tmp_path / "First.md"))
+    assert len(list(cache_dir.iterdir())) == 1
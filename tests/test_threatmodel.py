@@ -1,5 +1,7 @@
 import pytest
 from threatspec import threatmodel
+import io
+import json
 
 ###############################################################################
 # Basic objects
@@ -186,4 +188,104 @@ def test_threatmodel_library_parse_component_name():
     assert t.parse_name("Path:To:Component (#MYID)") == ("Path:To:Component", "#MYID")
     assert t.parse_name("Path:To:Component (An:Other:Component)") == ("Path:To:Component", "#an_other_component")
 
-    
\ No newline at end of file
+    
+
+###############################################################################
+# NDJSON streaming
+###############################################################################
+
+
+def test_threatmodel_stream_records(new_threatmodel):
+    source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+    stream = io.StringIO()
+
+    t = new_threatmodel()
+    t.open_stream(stream)
+    t.add_mitigation({"control": "A Control", "threat": "A Threat", "component": "A:Component"}, dict(source))
+    t.add_review({"component": "A:Component", "details": "check this"}, dict(source))
+    assert t.mitigations == []
+    assert t.reviews == []
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["kind"] for r in records] == ["threatmodel", "mitigation", "review"]
+    assert records[0]["run_id"] == "run_id"
+    assert records[1]["control"] == "#a_control"
+
+    loaded = new_threatmodel()
+    loaded.load_records(records)
+    assert len(loaded.mitigations) == 1
+    assert loaded.mitigations[0].component == "#a_component"
+    assert loaded.mitigations[0].source.as_dict() == source
+    assert len(loaded.reviews) == 1
+
+
+###############################################################################
+# Indexes
+###############################################################################
+
+
+def test_threatmodel_indexes(new_threatmodel):
+    source = {"annotation": "annotation", "code": "code", "filename": "filename", "line": 1}
+
+    t = new_threatmodel()
+    t.add_mitigation({"control": "A Control", "threat": "A Threat", "component": "A:Component"}, dict(source))
+    t.add_exposure({"threat": "A Threat", "component": "A:Component", "details": "details"}, dict(source))
+    t.add_exposure({"threat": "B Threat", "component": "A:Component", "details": "details"}, dict(source))
+    t.add_transfer({"threat": "C Threat", "source_component": "A:Component", "destination_component": "B:Component", "details": "details"}, dict(source))
+    t.add_connection({"source_component": "A:Component", "destination_component": "A:Component", "direction": "to", "details": "details"}, dict(source))
+    t.add_test({"control": "A Control", "component": "A:Component"}, dict(source))
+
+    assert t.mitigations_for("#a_component") == t.mitigations
+    assert t.exposures_for("#a_component") == t.exposures
+    assert t.records_for_component("#b_component", "transfer") == t.transfers
+    assert t.records_for_component("#a_component", "connection") == t.connections
+    assert t.records_for_threat("#c_threat", "transfer") == t.transfers
+    assert t.records_for_control("#a_control", "test") == t.tests
+    assert t.tests_for("#a_component", "#a_control") == t.tests
+    assert t.tests_for("#a_component", "#b_control") == []
+    assert t.mitigations_for("#unknown") == []
+    assert t.threats_for("#a_component") == ["#a_threat", "#b_threat", "#c_threat"]
+    assert t.unmitigated_exposures() == [t.exposures[1]]
+
+
+def test_threatmodel_remove_sources(new_threatmodel):
+    t = new_threatmodel()
+    for filename in ["a.py", "b.py"]:
+        source = {"annotation": "annotation", "code": "code", "filename": filename, "line": 1}
+        t.add_mitigation({"control": "A Control", "threat": "A Threat", "component": "A:Component"}, dict(source))
+        t.add_exposure({"threat": "B Threat", "component": "A:Component", "details": filename}, dict(source))
+
+    assert t.source_filenames() == {"a.py", "b.py"}
+    assert t.remove_sources({"a.py", "c.py"}) == 2
+    assert t.source_filenames() == {"b.py"}
+    assert t.mitigations_for("#a_component") == t.mitigations
+    assert [exposure.details for exposure in t.records_for_threat("#b_threat", "exposure")] == ["b.py"]
+
+
+def test_threatmodel_defaults_not_shared():
+    threatmodel.ThreatModel().mitigations.append("mitigation")
+    threatmodel.ThreatLibrary().threats["#threat"] = "threat"
+    assert threatmodel.ThreatModel().mitigations == []
+    assert threatmodel.ThreatLibrary().threats == {}
+
+
+def test_threatmodel_shares_source_strings(new_threatmodel):
+    t = new_threatmodel()
+    for line in [1, 2]:
+        source = {"annotation": "annotation", "code": "".join(["def handler():\n", "    pass\n"]), "filename": "".join(["path/", "file"]), "line": line}
+        t.add_review({"component": "A:Component", "details": "details"}, source)
+
+    assert t.reviews[0].source.code is t.reviews[1].source.code
+    assert t.reviews[0].source.filename is t.reviews[1].source.filename
+    assert t.reviews[0].component is t.reviews[1].component
+    assert not hasattr(t.reviews[0], "__dict__")
+    assert not hasattr(t.reviews[0].source, "__dict__")
+
+
+def test_threatmodel_library_parse_name_cached():
+    t = threatmodel.ThreatLibrary()
+
+    assert t.parse_name("A Cached Threat") == ("A Cached Threat", "#a_cached_threat")
+    hits = threatmodel.Library.parse_name.cache_info().hits
+    assert threatmodel.ControlLibrary().parse_name("A Cached Threat") == ("A Cached Threat", "#a_cached_threat")
+    assert threatmodel.Library.parse_name.cache_info().hits == hits + 1
@@ -0,0 +1,182 @@
+import pytest
+import os
+import json
+import time
+import errno
+from threatspec import app, watch
+
+
+def test_polling_watcher(tmp_path):
+    files = [str(tmp_path / name) for name in ["a.py", "b.py"]]
+    for path in files:
+        with open(path, "w") as fh:
+            fh.write("a")
+
+    watcher = watch.PollingWatcher(lambda: files, interval=0.01)
+    assert watcher.poll(0.02) == set()
+
+    with open(files[0], "w") as fh:
+        fh.write("ab")
+    os.remove(files[1])
+    assert watcher.poll(0.02) == set(files)
+    assert watcher.poll(0.02) == set()
+
+
+def test_watcher_changes_debounced():
+    class Events(watch.Watcher):
+        def __init__(self, events):
+            self.events = events
+
+        def poll(self, timeout=None):
+            return self.events.pop(0) if self.events else set()
+
+    changes = Events([{"a"}, {"b"}, set(), set(), {"c"}, set()]).changes()
+    assert next(changes) == {"a", "b"}
+    assert next(changes) == {"c"}
+
+    changes = Events([{"a"}, None, {"b"}, set()]).changes()
+    assert next(changes) is None
+
+    with pytest.raises(TypeError):
+        watch.Watcher()
+
+
+@pytest.mark.skipif(watch.load_libc() is None, reason="inotify is not available")
+def test_inotify_watcher(tmp_path):
+    watcher = watch.InotifyWatcher([str(tmp_path)])
+    try:
+        assert watcher.poll(0) == set()
+
+        (tmp_path / "a.py").write_text("a")
+        (tmp_path / "sub").mkdir()
+        assert watcher.poll(1) == {str(tmp_path / "a.py"), str(tmp_path / "sub")}
+
+        (tmp_path / "sub" / "b.py").write_text("b")
+        assert watcher.poll(1) == {str(tmp_path / "sub" / "b.py")}
+    finally:
+        watcher.close()
+
+
+@pytest.mark.skipif(watch.load_libc() is None, reason="inotify is not available")
+def test_inotify_watcher_directory_filter(tmp_path, monkeypatch):
+    watcher = watch.InotifyWatcher([str(tmp_path)], directory_filter=lambda d: os.path.basename(d) != "node_modules")
+    try:
+        (tmp_path / "node_modules" / "lib").mkdir(parents=True)
+        (tmp_path / "node_modules" / "lib" / "a.js").write_text("a")
+        (tmp_path / "src" / "lib").mkdir(parents=True)
+        (tmp_path / "src" / "node_modules").mkdir()
+        (tmp_path / "src" / "lib" / "b.js").write_text("b")
+        time.sleep(0.05)
+        assert watcher.poll(1) == {str(tmp_path / "node_modules"), str(tmp_path / "src"), str(tmp_path / "src" / "lib" / "b.js")}
+        assert sorted(watcher.directories.values()) == [str(tmp_path), str(tmp_path / "src"), str(tmp_path / "src" / "lib")]
+
+        # Running out of inotify watches means changes could be missed
+        def add_directory(directory):
+            raise OSError(errno.ENOSPC, "Couldn't watch directory {}".format(directory))
+        monkeypatch.setattr(watcher, "add_directory", add_directory)
+        (tmp_path / "other").mkdir()
+        assert watcher.poll(1) is None
+    finally:
+        watcher.close()
+
+
+class FakeWatcher():
+    """Yields the given change sets, then raises the exception if there is one."""
+
+    def __init__(self, changes, exception=None):
+        self.changes_list = changes
+        self.exception = exception
+        self.closed = False
+
+    def changes(self, debounce=0.1):
+        for changed in self.changes_list:
+            yield changed
+        if self.exception:
+            raise self.exception
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    app.ThreatSpecApp().init()
+    for (directory, name, threat) in [("src", "a.py", "XSS"), ("src", "b.py", "CSRF"), ("lib", "c.py", "SQLi")]:
+        (tmp_path / directory).mkdir(exist_ok=True)
+        (tmp_path / directory / name).write_text("# @exposes App:Web to {} with input\n".format(threat))
+    return tmp_path
+
+
+def exposures(path):
+    with open(str(path / "threatmodel" / "threatmodel.json")) as fh:
+        return sorted((e["threat"], os.path.basename(e["source"]["filename"])) for e in json.load(fh)["exposures"])
+
+
+def test_watch_changes_update(project):
+    threatspec = app.ThreatSpecApp()
+    threatspec.report_files = []
+    threatspec.load_local_config()
+    threatspec.load_libraries()
+    threatspec.update()
+    assert exposures(project) == [("#csrf", "b.py"), ("#sqli", "c.py"), ("#xss", "a.py")]
+
+    (project / "src" / "a.py").write_text("# @exposes App:Web to RCE with eval\n")
+    (project / "src" / "b.py").unlink()
+    reports = []
+    changed = {str(project / "src" / "a.py"), str(project / "src" / "b.py")}
+    output = {str(project / "threatmodel" / "threatmodel.json")}
+    threatspec.watch_changes(FakeWatcher([changed, output]), 0, lambda: reports.append(True))
+
+    # Only the changed file is parsed, and the deleted file's records are removed
+    assert threatspec.parsed_files == 1
+    assert exposures(project) == [("#rce", "a.py"), ("#sqli", "c.py")]
+    assert reports == [True]
+
+
+def test_watched_directory(project):
+    config_file = project / "threatspec.yaml"
+    config_file.write_text(config_file.read_text().replace("paths:                                 # Source code paths to process\n  - './'", "paths:\n  - path: './'\n    ignore: ['node_modules']"))
+    threatspec = app.ThreatSpecApp()
+    threatspec.report_files = []
+    threatspec.load_local_config()
+    threatspec.watched_files()
+
+    assert threatspec.watched_directory(str(project / "src" / "new"))
+    assert threatspec.watched_directory(str(project / "new"))
+    assert not threatspec.watched_directory(str(project / "node_modules"))
+    assert not threatspec.watched_directory(str(project / "src" / "node_modules" / "lib"))
+    assert not threatspec.watched_directory(str(project / "threatmodel" / "new"))
+    assert not threatspec.watched_directory(str(project / ".git"))
+
+
+def test_watch_config_change(project, monkeypatch):
+    threatspec = app.ThreatSpecApp()
+    watchers = [
+        FakeWatcher([{str(project / "threatspec.yaml")}, {str(project / "src" / "a.py")}]),
+        FakeWatcher([], KeyboardInterrupt())
+    ]
+    created = []
+    def watcher(polling, interval):
+        if not created:
+            assert exposures(project) == [("#csrf", "b.py"), ("#sqli", "c.py"), ("#xss", "a.py")]
+            config = (project / "threatspec.yaml").read_text()
+            (project / "threatspec.yaml").write_text(config.replace("paths:                                 # Source code paths to process\n  - './'", "paths:\n  - 'src'"))
+        created.append(watchers.pop(0))
+        return created[-1]
+    monkeypatch.setattr(threatspec, "watcher", watcher)
+
+    updates = []
+    update = threatspec.update
+    def record_update(changed=None):
+        updates.append(changed)
+        update(changed)
+    monkeypatch.setattr(threatspec, "update", record_update)
+
+    threatspec.watch()
+
+    # The configuration change stops watching before a.py is seen, and everything is
+    # parsed again with the new configuration
+    assert updates == [None, None]
+    assert len(created) == 2 and all(w.closed for w in created)
+    assert exposures(project) == [("#csrf", "b.py"), ("#xss", "a.py")]
@@ -3,9 +3,153 @@ logger = logging.getLogger(__name__)
 
 import os
 import sys
+import copy
 import uuid
+import multiprocessing
+import time
+import concurrent.futures
 import magic
-from threatspec import config, data, parser, reporter, threatmodel
+import jsonschema
+from threatspec import cache, config, data, git, parser, profiling, reporter, threatmodel, watch
+
+
+REPORT_FILES = {
+    "markdown": "ThreatModel.md",
+    "text": "ThreatModel.txt",
+    "json": "ThreatModel.json",
+    "template": "ThreatModel"
+}
+
+EXTENSION_MIME_TYPES = {
+    ".c": "text/x-c",
+    ".h": "text/x-c",
+    ".cc": "text/x-c++",
+    ".cpp": "text/x-c++",
+    ".cxx": "text/x-c++",
+    ".hh": "text/x-c++",
+    ".hpp": "text/x-c++",
+    ".cs": "text/x-c++",
+    ".go": "text/x-go",
+    ".htm": "text/html",
+    ".html": "text/html",
+    ".java": "text/x-java-source",
+    ".js": "application/javascript",
+    ".jsx": "application/javascript",
+    ".mjs": "application/javascript",
+    ".ts": "application/javascript",
+    ".tsx": "application/javascript",
+    ".py": "text/x-python",
+    ".rb": "text/x-ruby",
+    ".sh": "text/x-shellscript",
+    ".bash": "text/x-shellscript",
+    ".xml": "text/xml",
+    ".yaml": "text/plain",
+    ".yml": "text/plain",
+    ".txt": "text/plain"
+}
+
+FILENAME_MIME_TYPES = {
+    "Dockerfile": "text/x-shellscript",
+    "Makefile": "text/x-shellscript",
+    "Gemfile": "text/x-ruby",
+    "Rakefile": "text/x-ruby",
+    "Vagrantfile": "text/x-ruby"
+}
+
+magic_mime_cache = {}
+
+# Starting worker processes costs more than validating a few files in threads
+PREFETCH_PROCESS_THRESHOLD = 16
+
+# Written by run --cache alongside the threat model, relative to the project directory
+SOURCE_CACHE_FILE = os.path.join("threatmodel", "cache.json")
+
+
+def get_mime_for_path(path, content=None):
+    """Classify a file by its name or extension, falling back to libmagic.
+
+    If the file has already been read, libmagic inspects the given content rather
+    than reading the file again. libmagic results are memoized per directory and
+    extension. Files without an extension are always sniffed, as a directory of
+    scripts can mix languages.
+    """
+    filename = os.path.basename(path)
+    if filename in FILENAME_MIME_TYPES:
+        return FILENAME_MIME_TYPES[filename]
+
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext in EXTENSION_MIME_TYPES:
+        return EXTENSION_MIME_TYPES[ext]
+
+    if not ext:
+        return sniff_mime(path, content)
+
+    key = (os.path.dirname(path), ext)
+    if key not in magic_mime_cache:
+        magic_mime_cache[key] = sniff_mime(path, content)
+    return magic_mime_cache[key]
+
+
+def sniff_mime(path, content=None):
+    if content is None:
+        return magic.from_file(path, mime=True)
+    return magic.from_buffer(content, mime=True)
+
+
+def get_parser_for_path(threatmodel, path, config_path, content=None):
+    with profiling.phase("classification"):
+        mime = config_path.get_mime(path)
+        if not mime:
+            mime = get_mime_for_path(path, content)
+    _, ext = os.path.splitext(path)
+
+    if mime == "text/plain":
+        if ext in [".yaml", ".yml"]:
+            return parser.YamlFileParser(threatmodel)
+        elif ext in [".txt"]:
+            return parser.TextFileParser(threatmodel)
+        else:
+            logger.warn("Unsupported file extension {} for mime type text/plain for file {}".format(ext, path))
+            return None
+    else:
+        return parser.SourceFileParser(threatmodel, mime, config_path.context_lines)
+
+
+def parse_file_records(job):
+    """Parse a single file in a worker process, returning the annotations as plain records.
+
+    Returns None if the file was skipped because it can't contain any annotations.
+    """
+    (path, config_path) = job
+    with profiling.phase("file read"):
+        content = parser.read_source(path)
+    if content is None:
+        return None
+    recorder = parser.AnnotationRecorder()
+    file_parser = get_parser_for_path(recorder, path, config_path, content)
+    if file_parser:
+        with profiling.phase("annotation parsing"):
+            file_parser.parse_file(path, content)
+    return recorder.records
+
+
+def profile_file_records(job):
+    """Like parse_file_records, but also returns how long the file took to parse."""
+    start = time.perf_counter()
+    records = parse_file_records(job)
+    return (records, time.perf_counter() - start)
+
+
+def source_filenames(paths):
+    """Returns the filenames that records from the given absolute paths can have. The
+    YAML and text parsers store paths relative to the working directory."""
+    filenames = set(paths)
+    cwd = data.cwd()
+    for path in paths:
+        if path.startswith(cwd):
+            filenames.add(path.replace(cwd, "", 1).lstrip(os.path.sep))
+    return filenames
 
 
 class ThreatSpecApp():
@@ -26,31 +170,19 @@ class ThreatSpecApp():
         self.config = config.Config()
         self.parser = None
         self.reporter = None
+        self.source_cache = None
+        self.parsed_files = 0
+        self.skipped_files = 0
 
         self.loaded_source_paths = {}
         self.loaded_library_paths = {}
+        self.prefetched_files = {}
+        self.report_files = []
 
-    def get_parser_for_path(self, path, config_path):
-        if config_path.mime:
-            mime = config_path.mime
-        else:
-            mime = magic.from_file(path, mime=True)
-        _, ext = os.path.splitext(path)
-
-        if mime == "text/plain":
-            if ext in [".yaml", ".yml"]:
-                return parser.YamlFileParser(self.threatmodel)
-            elif ext in [".json"]:
-                return parser.YamlFileParser(self.threatmodel)
-            elif ext in [".txt"]:
-                return parser.TextFileParser(self.threatmodel)
-            else:
-                logger.warn("Unsupported file extension {} for mime type text/plain for file {}".format(ext, path))
-                return None
-        else:
-            return parser.SourceFileParser(self.threatmodel, mime)
+    def get_parser_for_path(self, path, config_path, content=None):
+        return get_parser_for_path(self.threatmodel, path, config_path, content)
 
-    def parse_source(self, paths, parent):
+    def source_files(self, paths, parent, changed=None):
         for config_path in paths:
             abs_path = data.abs_path(parent, config_path.path)
 
@@ -63,7 +195,7 @@ class ThreatSpecApp():
                 logger.debug("Skipping source path {} as it has already been processed".format(abs_path))
                 continue
 
-            self.loaded_source_paths[abs_path] = True  # We've seen it now
+            self.loaded_source_paths[abs_path] = config_path  # We've seen it now
             if data.is_threatspec_path(abs_path):
                 logger.debug("Found threatspec.yaml, loading source configuration from {}".format(abs_path))
                 new_config = config.Config()
@@ -75,115 +207,266 @@ class ThreatSpecApp():
                     sys.exit(1)
 
                 new_config.load(data.read_yaml(new_config_file))
-                self.parse_source(new_config.paths, abs_path)
+                yield from self.source_files(new_config.paths, abs_path, changed)
 
-            for path in data.recurse_path(abs_path):
-                if data.path_ignored(path, config_path.ignore):
-                    logger.debug("Skipping ignored file path: {}".format(path))
-                    continue
+            if changed is None:
+                files = data.recurse_path(abs_path, config_path.ignore, config_path.gitignore)
+            else:
+                files = data.select_paths(changed, abs_path, config_path.ignore, config_path.gitignore)
+            for path in files:
                 logger.debug("Parsing source files in path {}".format(path))
-                if os.path.isfile(path):
-                    self.parser = self.get_parser_for_path(path, config_path)
-                    if self.parser:
-                        self.parser.parse_file(path)
+                yield (path, config_path)
+
+    def parse_source(self, paths, parent, jobs=1, changed=None):
+        if jobs > 1 or self.source_cache:
+            self.parse_source_records(paths, parent, jobs, changed)
+            return
+
+        for (path, config_path) in profiling.timed("file walk", self.source_files(paths, parent, changed)):
+            start = time.perf_counter()
+            with profiling.phase("file read"):
+                content = parser.read_source(path)
+            if content is None:
+                logger.debug("Skipping file without annotations: {}".format(path))
+                self.skipped_files += 1
+                continue
+            self.parsed_files += 1
+            self.parser = self.get_parser_for_path(path, config_path, content)
+            if self.parser:
+                with profiling.phase("annotation parsing"):
+                    self.parser.parse_file(path, content)
+            profiling.profiler.file(path, time.perf_counter() - start)
+
+    def parse_source_records(self, paths, parent, jobs, changed=None):
+        files = list(profiling.timed("file walk", self.source_files(paths, parent, changed)))
+        if self.source_cache:
+            cached = [self.source_cache.get(path, config_path.get_options(path)) for (path, config_path) in files]
+            logger.debug("Reusing cached annotations for {} of {} source files".format(self.source_cache.hits, len(files)))
+        else:
+            cached = [None] * len(files)
+        misses = [job for (job, records) in zip(files, cached) if records is None]
+
+        if jobs > 1:
+            logger.debug("Parsing {} source files with {} jobs".format(len(misses), jobs))
+            chunksize = max(1, len(misses) // (jobs * 8))
+            with multiprocessing.Pool(jobs) as pool:
+                parsed = self.profile_records(misses, pool.imap(profile_file_records, misses, chunksize))
+                # The parsing phases happen in the workers, so only the time taken per file is known
+                with profiling.phase("parsing (workers)", len(misses)):
+                    self.replay_records(files, cached, parsed)
+        else:
+            with profiling.phase("record replay", len(files)):
+                self.replay_records(files, cached, self.profile_records(misses, map(profile_file_records, misses)))
+
+    def profile_records(self, jobs, results):
+        for ((path, config_path), (records, seconds)) in zip(jobs, results):
+            profiling.profiler.file(path, seconds)
+            yield records
+
+    def replay_records(self, files, cached, parsed):
+        # Records are replayed in file order so the threat model matches a serial run
+        self.parser = parser.Parser(self.threatmodel)
+        for ((path, config_path), records) in zip(files, cached):
+            if records is None:
+                records = next(parsed)
+                if records is None:
+                    self.skipped_files += 1
+                    records = []
+                else:
+                    self.parsed_files += 1
+                if self.source_cache:
+                    self.source_cache.set(path, config_path.get_options(path), records)
+            for (annotation, source) in records:
+                if self.source_cache:
+                    # The threat model consumes the dicts it is given, so keep the cached copy intact
+                    (annotation, source) = copy.deepcopy((annotation, source))
+                self.parser.run_action(annotation, source)
+
+    def load_threat_model(self, path, exclude=None):
+        """Loads a threat model, leaving out the records from the files in exclude."""
+        ndjson_filename = data.abs_path(path, "threatmodel", "threatmodel.ndjson")
+        if os.path.isfile(ndjson_filename):
+            self.load_threat_model_records(ndjson_filename, exclude)
+            return
 
-    def load_threat_model(self, path):
         filename = data.abs_path(path, "threatmodel", "threatmodel.json")
 
-        logger.debug("Validating {}".format(filename))
-        (valid, error) = data.validate_yaml_file(filename, os.path.join("data", "threatmodel_schema.json"))
-        if not valid:
-            logger.error("Couldn't validate the threat model file {}: {}".format(filename, error))
-            sys.exit(1)
-
+        logger.debug("Loading and validating {}".format(filename))
+        (document, error) = self.read_validated_json(filename, os.path.join("data", "threatmodel_schema.json"))
+        if not document:
+            if error:
+                logger.error("Couldn't validate the threat model file {}: {}".format(filename, error))
+                sys.exit(1)
+            return
+
+        if exclude:
+            exclude = source_filenames(exclude)
+            for (kind, records) in document.items():
+                if isinstance(records, list):
+                    document[kind] = [record for record in records if record["source"]["filename"] not in exclude]
+        self.threatmodel.load(document)
+        logger.debug("Loaded threat model from {}".format(filename))
+
+    def load_threat_model_records(self, filename, exclude=None):
+        logger.debug("Loading and validating {}".format(filename))
         try:
-            self.threatmodel.load(data.read_json(filename))
+            records = data.validate_ndjson_records(data.read_ndjson(filename), os.path.join("data", "threatmodel_schema.json"))
+            if exclude:
+                exclude = source_filenames(exclude)
+                records = (record for record in records if "source" not in record or record["source"]["filename"] not in exclude)
+            self.threatmodel.load_records(records)
             logger.debug("Loaded threat model from {}".format(filename))
-        except FileNotFoundError:
-            pass
+        except (jsonschema.exceptions.ValidationError, ValueError) as e:
+            logger.error("Couldn't validate the threat model file {}: {}".format(filename, str(e)))
+            sys.exit(1)
 
-    def save_threat_model(self):
-        data.write_json_pretty(self.threatmodel.save(), data.cwd(), "threatmodel", "threatmodel.json")  # TODO: Unhardcode
+    def open_threat_model_stream(self):
+        filename = data.abs_path(data.cwd(), "threatmodel", "threatmodel.ndjson.tmp")
+        self.threatmodel.open_stream(open(filename, "w"))
 
-    def load_threat_models(self):
-        self.load_threat_model(data.cwd())
+    def discard_threat_model_stream(self):
+        """Closes and removes a partly written NDJSON threat model, if the run failed before it was saved."""
+        if self.threatmodel.stream:
+            self.threatmodel.close_stream()
+            data.remove_file(data.cwd(), "threatmodel", "threatmodel.ndjson.tmp")
 
+    def save_threat_model(self):
+        # Only one format is kept, so stale output in the other format is never loaded
+        if self.threatmodel.stream:
+            self.threatmodel.close_stream()
+            os.replace(data.abs_path(data.cwd(), "threatmodel", "threatmodel.ndjson.tmp"), data.abs_path(data.cwd(), "threatmodel", "threatmodel.ndjson"))
+            data.remove_file(data.cwd(), "threatmodel", "threatmodel.json")
+        else:
+            data.write_json_pretty(self.threatmodel.save(), data.cwd(), "threatmodel", "threatmodel.json")  # TODO: Unhardcode
+            data.remove_file(data.cwd(), "threatmodel", "threatmodel.ndjson")
+
+    def import_paths(self):
+        paths = [data.cwd()]
         for import_path in self.config.imports:
             abs_import_path = data.abs_path(import_path.path)
             if abs_import_path == data.cwd():
-                continue  # Local path processed above
-            self.load_threat_model(abs_import_path)
+                continue  # Local path processed first
+            paths.append(abs_import_path)
+        return paths
+
+    def prefetch_files(self, files, jobs=1):
+        """Start reading and validating JSON files concurrently, returning the executor
+        so that the caller can shut it down once the files are loaded.
+
+        The results are picked up by read_validated_json as the files are loaded, so
+        they are still merged in the usual order. Threads overlap the I/O, and with more
+        than one job and at least PREFETCH_PROCESS_THRESHOLD files a process pool is used
+        so validation also runs in parallel.
+        """
+        if not files:
+            return None
+        if jobs > 1 and len(files) >= PREFETCH_PROCESS_THRESHOLD:
+            executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(min(32, len(files)))
+        for (filename, schema_file) in files:
+            if filename not in self.prefetched_files:
+                self.prefetched_files[filename] = executor.submit(data.read_validated_json, filename, schema_file)
+        return executor
+
+    def finish_prefetch(self, executor):
+        """Waits for the prefetch workers to exit, so none are left running while the
+        source files are parsed."""
+        self.prefetched_files = {}
+        if executor:
+            executor.shutdown(wait=True)
+
+    def read_validated_json(self, filename, schema_file):
+        future = self.prefetched_files.pop(filename, None)
+        if future:
+            return future.result()
+        return data.read_validated_json(filename, schema_file)
+
+    def load_threat_models(self, jobs=1):
+        paths = self.import_paths()
+        files = []
+        for path in paths:
+            if not os.path.isfile(data.abs_path(path, "threatmodel", "threatmodel.ndjson")):
+                files.append((data.abs_path(path, "threatmodel", "threatmodel.json"), os.path.join("data", "threatmodel_schema.json")))
+        executor = self.prefetch_files(files, jobs)
+        try:
+            for path in paths:
+                self.load_threat_model(path)
+        finally:
+            self.finish_prefetch(executor)
 
     def load_threat_library(self, path, local=False):
         filename = data.abs_path(path, "threatmodel", "threats.json")
 
-        logger.debug("Validating {}".format(filename))
-        (valid, error) = data.validate_yaml_file(filename, os.path.join("data", "threats_schema.json"))
-        if not valid:
-            logger.error("Couldn't validate the threat library file {}: {}".format(filename, error))
-            sys.exit(1)
+        logger.debug("Loading and validating {}".format(filename))
+        (document, error) = self.read_validated_json(filename, os.path.join("data", "threats_schema.json"))
+        if not document:
+            if error:
+                logger.error("Couldn't validate the threat library file {}: {}".format(filename, error))
+                sys.exit(1)
+            return
 
-        try:
-            if local:
-                run_id = self.threatmodel.run_id
-            else:
-                run_id = None
-            self.threat_library.load(data.read_json(filename), run_id)
-            logger.debug("Loaded threat library from {}".format(filename))
-        except FileNotFoundError:
-            pass
+        if local:
+            run_id = self.threatmodel.run_id
+        else:
+            run_id = None
+        self.threat_library.load(document, run_id)
+        logger.debug("Loaded threat library from {}".format(filename))
 
     def load_control_library(self, path, local=False):
         filename = data.abs_path(path, "threatmodel", "controls.json")
 
-        logger.debug("Validating {}".format(filename))
-        (valid, error) = data.validate_yaml_file(filename, os.path.join("data", "controls_schema.json"))
-        if not valid:
-            logger.error("Couldn't validate the control library file {}: {}".format(filename, error))
-            sys.exit(1)
+        logger.debug("Loading and validating {}".format(filename))
+        (document, error) = self.read_validated_json(filename, os.path.join("data", "controls_schema.json"))
+        if not document:
+            if error:
+                logger.error("Couldn't validate the control library file {}: {}".format(filename, error))
+                sys.exit(1)
+            return
 
-        try:
-            if local:
-                run_id = self.threatmodel.run_id
-            else:
-                run_id = None
-            self.control_library.load(data.read_json(filename), run_id)
-            logger.debug("Loaded control library from path {}".format(filename))
-        except FileNotFoundError:
-            pass
+        if local:
+            run_id = self.threatmodel.run_id
+        else:
+            run_id = None
+        self.control_library.load(document, run_id)
+        logger.debug("Loaded control library from path {}".format(filename))
 
     def load_component_library(self, path, local=False):
         filename = data.abs_path(path, "threatmodel", "components.json")
 
-        logger.debug("Validating {}".format(filename))
-        (valid, error) = data.validate_yaml_file(filename, os.path.join("data", "components_schema.json"))
-        if not valid:
-            logger.error("Couldn't validate the components library file {}: {}".format(filename, error))
-            sys.exit(1)
+        logger.debug("Loading and validating {}".format(filename))
+        (document, error) = self.read_validated_json(filename, os.path.join("data", "components_schema.json"))
+        if not document:
+            if error:
+                logger.error("Couldn't validate the components library file {}: {}".format(filename, error))
+                sys.exit(1)
+            return
 
-        try:
-            if local:
-                run_id = self.threatmodel.run_id
-            else:
-                run_id = None
-            self.component_library.load(data.read_json(filename), run_id)
-            logger.debug("Loaded component library from path {}".format(filename))
-        except FileNotFoundError:
-            pass
+        if local:
+            run_id = self.threatmodel.run_id
+        else:
+            run_id = None
+        self.component_library.load(document, run_id)
+        logger.debug("Loaded component library from path {}".format(filename))
 
-    def load_libraries(self):
+    def load_libraries(self, jobs=1):
         self.create_directories()
-        self.load_threat_library(data.cwd(), local=True)
-        self.load_control_library(data.cwd(), local=True)
-        self.load_component_library(data.cwd(), local=True)
 
-        for import_path in self.config.imports:
-            abs_import_path = data.abs_path(import_path.path)
-            if abs_import_path == data.cwd():
-                continue  # Local path processed above
-            self.load_threat_library(abs_import_path, local=False)
-            self.load_control_library(abs_import_path, local=False)
-            self.load_component_library(abs_import_path, local=False)
+        paths = self.import_paths()
+        files = []
+        for path in paths:
+            files.append((data.abs_path(path, "threatmodel", "threats.json"), os.path.join("data", "threats_schema.json")))
+            files.append((data.abs_path(path, "threatmodel", "controls.json"), os.path.join("data", "controls_schema.json")))
+            files.append((data.abs_path(path, "threatmodel", "components.json"), os.path.join("data", "components_schema.json")))
+        executor = self.prefetch_files(files, jobs)
+        try:
+            for path in paths:
+                local = path == data.cwd()
+                self.load_threat_library(path, local=local)
+                self.load_control_library(path, local=local)
+                self.load_component_library(path, local=local)
+        finally:
+            self.finish_prefetch(executor)
 
     def save_libraries(self):
         data.write_json_pretty(self.threat_library.save(self.threatmodel.run_id), data.cwd(), "threatmodel", "threats.json")
@@ -230,72 +513,301 @@ repository by editing the following file:
             logger.error("Failed to create directories: {}".format(str(e)))
             raise
 
-    def run(self):
+    def load_source_cache(self):
+        self.source_cache = cache.SourceCache()
+        self.source_cache.load(data.cwd(), SOURCE_CACHE_FILE)
+
+    def save_source_cache(self):
+        self.source_cache.save(data.cwd(), SOURCE_CACHE_FILE)
+        logger.debug("Source cache hits: {}, misses: {}".format(self.source_cache.hits, self.source_cache.misses))
+
+    def changed_files(self, since):
+        """Returns the files changed since the given git revision, or None if all the
+        source files need to be parsed again."""
+        try:
+            changed = git.changed_files(data.cwd(), since)
+        except git.GitError as e:
+            logger.error("Couldn't get the files changed since {}: {}".format(since, str(e)))
+            sys.exit(1)
+
+        if not any(os.path.isfile(data.abs_path(data.cwd(), "threatmodel", f)) for f in ["threatmodel.json", "threatmodel.ndjson"]):
+            logger.info("No existing threat model found, parsing all source files")
+            return None
+        if any(os.path.basename(path) == "threatspec.yaml" for path in changed):
+            logger.info("Configuration has changed since {}, parsing all source files".format(since))
+            return None
+
+        logger.debug("{} files changed since {}".format(len(changed), since))
+        return changed
+
+    def run(self, jobs=1, use_cache=False, model_format="json", since=None):
         logger.info("Running threatspec...")
-        self.load_local_config()
-        self.load_libraries()
-        self.parse_source(self.config.paths, data.cwd())
-        self.save_libraries()
-        self.save_threat_model()
+        with profiling.phase("config load"):
+            self.load_local_config()
+        with profiling.phase("library load"):
+            self.load_libraries(jobs)
+        if use_cache:
+            with profiling.phase("source cache load"):
+                self.load_source_cache()
+
+        changed = None
+        if since:
+            changed = self.changed_files(since)
+        if model_format == "ndjson":
+            self.open_threat_model_stream()
+        try:
+            if changed is not None:
+                # Annotations in unchanged files are kept from the previous run
+                with profiling.phase("model load"):
+                    self.load_threat_model(data.cwd(), changed)
+
+            self.parse_source(self.config.paths, data.cwd(), jobs, changed)
+            if use_cache:
+                if changed is not None:
+                    self.source_cache.retain(lambda path: path not in changed)
+                with profiling.phase("source cache save"):
+                    self.save_source_cache()
+            with profiling.phase("library save", 3):
+                self.save_libraries()
+            with profiling.phase("model save"):
+                self.save_threat_model()
+        finally:
+            self.discard_threat_model_stream()
+
+        logger.info("Parsed {} source files, skipped {} files without annotations".format(self.parsed_files, self.skipped_files))
+        if use_cache:
+            logger.info("Reused cached annotations for {} unchanged files".format(self.source_cache.hits))
 
         logger.info("""
 Threatspec has been run against the source files. The following threat mode file
 has been created and contains the mitigations, acceptances, connections etc. for
 the project:
 
-    threatmodel/threatmodel.json
+    threatmodel/threatmodel.{}
 
 The following library files have also been created:
 
     threatmodel/threats.json threatmodel/controls.json threatmodel/components.json
-        """)
-
-    def report(self, output, file=None, template_file=None):
-        logger.info("Generating report...")
-
-        self.load_local_config()
-        self.load_libraries()
-        self.load_threat_models()
-
-        report_data = reporter.DataReporter(self.config.project, self.threatmodel)
+        """.format(model_format))
+
+    def report_outputs(self, outputs, file=None):
+        """Returns a list of (format, filename) pairs from output specifications of
+        the form "format" or "format:filename", optionally comma separated."""
+        reports = []
+        for spec in outputs:
+            for output in spec.split(","):
+                output = output.strip()
+                if not output:
+                    continue
+                (output, _, filename) = output.partition(":")
+                output = output.lower()
+                if output not in REPORT_FILES:
+                    logger.error("Invalid report type: {}".format(output))
+                    sys.exit(1)
+                reports.append((output, filename or None))
 
-        if output.lower() == "template":
-            if not template_file:
-                logger.error("Template must be provided for template reports")
+        if file:
+            if len(reports) != 1:
+                logger.error("A report filename can only be given for a single output, use format:filename instead")
                 sys.exit(1)
-            if not file:
-                file = "ThreatModel"
-            report = reporter.TemplateReporter(report_data.data)
-            report.generate(file, template_file)
-            logger.info("The following threat model has been created: {}".format(file))
-
-        elif output.lower() == "markdown":
-            if not file:
-                file = "ThreatModel.md"
+            reports[0] = (reports[0][0], reports[0][1] or file)
+
+        return [(output, filename or REPORT_FILES[output]) for (output, filename) in reports]
+
+    def report_tasks(self, output, file, template_file, report_data, split_diagrams=False, diagram_cache=True):
+        """Returns the independent steps needed to generate a report, as callables."""
+        def generate(report, message, *args, **kwargs):
+            def task():
+                report.generate(*args, **kwargs)
+                logger.info(message)
+            return task
+
+        if output == "template":
+            report = reporter.TemplateReporter(report_data)
+            return [generate(report, "The following threat model has been created: {}".format(file), file, template_file)]
+
+        elif output == "markdown":
+            if diagram_cache:
+                gv = reporter.GraphvizReporter(report_data, split_diagrams,
+                    data.abs_path(data.cwd(), "threatmodel", "diagrams.json"), data.abs_path(data.cwd(), "threatmodel", "diagram_cache"))
+            else:
+                gv = reporter.GraphvizReporter(report_data, split_diagrams)
+            report = reporter.MarkdownReporter(report_data, self.config)
+            if split_diagrams:
+                diagrams = list(gv.diagram_files(file).items())
+                return [
+                    generate(gv, "The following threat model visualisation images have been created: {}".format(", ".join(f for (name, f) in diagrams)), file),
+                    generate(report, "The following threat model markdown report has been created: {}".format(file), file, diagrams=diagrams)
+                ]
 
             png_file = file + ".png"
-            gv = reporter.GraphvizReporter(report_data.data)
-            gv.generate(file)
-            logger.info("The following threat model visualisation image has been created: {}".format(png_file))
-
-            report = reporter.MarkdownReporter(report_data.data, self.config)
-            report.generate(file, image=png_file)
-            logger.info("The following threat model markdown report has been created: {}".format(file))
-
-        elif output.lower() == "text":
-            if not file:
-                file = "ThreatModel.txt"
-            report = reporter.TextReporter(report_data.data)
-            report.generate(file)
-            logger.info("The following threat model text file has been created: {}".format(file))
-
-        elif output.lower() == "json":
-            if not file:
-                file = "ThreatModel.json"
-            report = reporter.JsonReporter(report_data.data)
-            report.generate(file)
-            logger.info("The following threat model JSON file has been created: {}".format(file))
+            return [
+                generate(gv, "The following threat model visualisation image has been created: {}".format(png_file), file),
+                generate(report, "The following threat model markdown report has been created: {}".format(file), file, image=png_file)
+            ]
+
+        elif output == "text":
+            report = reporter.TextReporter(report_data)
+            return [generate(report, "The following threat model text file has been created: {}".format(file), file)]
+
+        elif output == "json":
+            report = reporter.JsonReporter(report_data)
+            return [generate(report, "The following threat model JSON file has been created: {}".format(file), file)]
+
+    def report(self, outputs, file=None, template_file=None, jobs=1, split_diagrams=False, diagram_cache=True):
+        if isinstance(outputs, str):
+            outputs = [outputs]
+        reports = self.report_outputs(outputs, file)
+        if not reports:
+            logger.error("At least one report output format must be provided")
+            sys.exit(1)
+        if not template_file and any(output == "template" for (output, filename) in reports):
+            logger.error("Template must be provided for template reports")
+            sys.exit(1)
 
+        logger.info("Generating report...")
+
+        with profiling.phase("config load"):
+            self.load_local_config()
+        with profiling.phase("library load"):
+            self.load_libraries(jobs)
+        with profiling.phase("model load"):
+            self.load_threat_models(jobs)
+
+        reporter.set_template_cache(data.user_cache_dir("template_cache"))
+        self.write_reports(reports, template_file, split_diagrams, diagram_cache)
+
+    def write_reports(self, reports, template_file=None, split_diagrams=False, diagram_cache=True):
+        with profiling.phase("report build"):
+            report_data = reporter.DataReporter(self.config.project, self.threatmodel)
+
+        tasks = []
+        for (output, filename) in reports:
+            tasks += self.report_tasks(output, filename, template_file, report_data.data, split_diagrams, diagram_cache)
+
+        # Reports only read the shared report data, so they can be written concurrently.
+        # Most of the time goes into the Graphviz subprocess and file I/O, which threads
+        # can overlap with template rendering.
+        if len(tasks) == 1:
+            tasks[0]()
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            for future in [executor.submit(task) for task in tasks]:
+                future.result()
+
+    def is_output_path(self, path):
+        """Checks for the files written by threatspec itself, so that writing them
+        doesn't look like a change to the source files."""
+        output_directory = data.abs_path(data.cwd(), "threatmodel")
+        if path == output_directory or path.startswith(output_directory + os.sep):
+            return True
+        return any(path == filename or path.startswith(filename + ".") for filename in self.report_files)
+
+    def watched_files(self):
+        self.loaded_source_paths = {}
+        files = [path for (path, config_path) in self.source_files(self.config.paths, data.cwd())]
+        config_files = [data.abs_path(path, "threatspec.yaml") for path in [data.cwd()] + list(self.loaded_source_paths) if data.is_threatspec_path(path)]
+        return [path for path in files if not self.is_output_path(path)] + config_files
+
+    def watched_directories(self):
+        directories = {data.cwd()}
+        for (abs_path, config_path) in self.loaded_source_paths.items():
+            directories.update(data.recurse_directories(abs_path, config_path.ignore, config_path.gitignore))
+        return sorted(directory for directory in directories if not self.is_output_path(directory))
+
+    def watched_directory(self, directory):
+        """Checks whether a directory created while watching holds source files."""
+        if self.is_output_path(directory):
+            return False
+        return any(data.directory_selected(directory, abs_path, config_path.ignore, config_path.gitignore)
+                   for (abs_path, config_path) in self.loaded_source_paths.items())
+
+    def watcher(self, polling=False, interval=0.5):
+        if not polling:
+            try:
+                return watch.InotifyWatcher(self.watched_directories(), directory_filter=self.watched_directory)
+            except OSError as e:
+                logger.warn("Couldn't watch the source paths with inotify, polling for changes every {}s instead: {}".format(interval, str(e)))
+        return watch.PollingWatcher(self.watched_files, interval)
+
+    def update(self, changed=None):
+        """Parses the changed files again, replacing their records in the threat model,
+        or reloads the configuration and parses all the source files if changed is None.
+        The threat model and libraries are then saved."""
+        self.loaded_source_paths = {}
+        self.parsed_files = 0
+        self.skipped_files = 0
+
+        if changed is None:
+            self.config = config.Config()
+            self.load_local_config()
+            removed = self.threatmodel.source_filenames()
         else:
-            logger.error("Invalid report type: {}".format(output))
+            removed = source_filenames(changed)
+            # Only the directory itself is reported when a directory is deleted or renamed
+            directories = tuple(path + os.sep for path in changed if not os.path.exists(path))
+            if directories:
+                removed.update(f for f in self.threatmodel.source_filenames() if data.abs_path(data.cwd(), f).startswith(directories))
+        with profiling.phase("record removal"):
+            self.threatmodel.remove_sources(removed)
+
+        self.parse_source(self.config.paths, data.cwd(), 1, changed)
+        with profiling.phase("library save", 3):
+            self.save_libraries()
+        with profiling.phase("model save"):
+            self.save_threat_model()
+
+    def watch_changes(self, watcher, debounce, write_reports):
+        """Updates the threat model after each burst of changes. Returns when all the
+        source files need to be parsed again, e.g. because the configuration changed."""
+        for changed in watcher.changes(debounce):
+            if changed is not None:
+                changed = {path for path in changed if not self.is_output_path(path)}
+                if not changed:
+                    continue
+                if any(os.path.basename(path) == "threatspec.yaml" for path in changed):
+                    logger.info("Configuration has changed, parsing all source files")
+                    return
+                logger.debug("Changed paths: {}".format(", ".join(sorted(changed))))
+
+            start = time.perf_counter()
+            self.update(changed)
+            write_reports()
+            logger.info("Updated the threat model in {:.2f}s, parsed {} changed files".format(time.perf_counter() - start, self.parsed_files))
+            if changed is None:
+                return
+
+    def watch(self, outputs=(), template_file=None, split_diagrams=False, diagram_cache=True, polling=False, interval=0.5, debounce=0.1):
+        if isinstance(outputs, str):
+            outputs = [outputs]
+        reports = self.report_outputs(outputs) if outputs else []
+        if not template_file and any(output == "template" for (output, filename) in reports):
+            logger.error("Template must be provided for template reports")
             sys.exit(1)
+        self.report_files = [data.abs_path(data.cwd(), filename) for (output, filename) in reports]
+
+        def write_reports():
+            if reports:
+                self.write_reports(reports, template_file, split_diagrams, diagram_cache)
+
+        logger.info("Watching threatspec source files...")
+        self.load_local_config()
+        self.load_libraries()
+        reporter.set_template_cache(data.user_cache_dir("template_cache"))
+
+        try:
+            while True:
+                start = time.perf_counter()
+                self.update()
+                write_reports()
+                logger.info("Parsed {} source files, skipped {} files without annotations in {:.2f}s".format(
+                    self.parsed_files, self.skipped_files, time.perf_counter() - start))
+
+                watcher = self.watcher(polling, interval)
+                logger.info("Waiting for changes, press Ctrl-C to stop")
+                try:
+                    self.watch_changes(watcher, debounce, write_reports)
+                finally:
+                    watcher.close()
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
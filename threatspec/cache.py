@@ -0,0 +1,86 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import hashlib
+from threatspec import data
+
+CACHE_VERSION = 2
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SourceCache():
+    """Annotation records produced by each source file, keyed by path.
+
+    An entry is reused when the file's parsing options are the same and its mtime and
+    size are unchanged, or failing that when its content digest still matches (e.g.
+    after a fresh checkout). Only the entries used in the current run are saved, so
+    deleted files are dropped.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.seen = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, *path):
+        try:
+            cache = data.read_json(*path)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warn("Ignoring invalid source cache file {}: {}".format(os.path.join(*path), str(e)))
+            return
+
+        if cache.get("version") != CACHE_VERSION:
+            logger.debug("Ignoring source cache with version {}".format(cache.get("version")))
+            return
+        self.entries = cache["files"]
+
+    def save(self, *path):
+        data.write_json_pretty({"version": CACHE_VERSION, "files": self.seen}, *path)
+
+    def retain(self, predicate):
+        """Keeps the entries for the paths matching predicate, even though they weren't
+        used in this run."""
+        for (path, entry) in self.entries.items():
+            if path not in self.seen and predicate(path):
+                self.seen[path] = entry
+
+    def get(self, path, options):
+        entry = self.entries.get(path)
+        if entry is None or entry["options"] != options:
+            self.misses += 1
+            return None
+
+        stat = os.stat(path)
+        if entry["size"] != stat.st_size:
+            self.misses += 1
+            return None
+        if entry["mtime"] != stat.st_mtime_ns:
+            if entry["digest"] != file_digest(path):
+                self.misses += 1
+                return None
+            entry["mtime"] = stat.st_mtime_ns
+
+        self.hits += 1
+        self.seen[path] = entry
+        return entry["records"]
+
+    def set(self, path, options, records):
+        stat = os.stat(path)
+        self.seen[path] = {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": file_digest(path),
+            "options": options,
+            "records": records
+        }
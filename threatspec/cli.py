@@ -2,7 +2,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 import click
-from threatspec import app
+from threatspec import app, profiling
 
 
 def validate_logging(ctx, param, value):
@@ -19,6 +19,12 @@ def validate_logging(ctx, param, value):
     raise click.BadParameter("Log level must be one of: {}".format(", ".join(levels.keys())))
 
 
+def report_profile(output, top):
+    click.echo(profiling.profiler.summary(top), err=True)
+    if output:
+        profiling.profiler.write_trace(output, top)
+
+
 def configure_logger(level, verbose):
     if verbose:
         logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=level)
@@ -29,8 +35,12 @@ def configure_logger(level, verbose):
 @click.group()
 @click.option("--log-level", "-l", callback=validate_logging, default="info", help="Set the log level. Must be one of: crit, error, warn, info, debug, none.")
 @click.option("--verbose/--no-verbose", default=False, help="Makes logging more verbose.")
+@click.option("--profile", is_flag=True, help="Print the time spent in each phase of the command when it finishes.")
+@click.option("--profile-output", help="Also write the profile to this file as JSON. Implies --profile.")
+@click.option("--profile-top", type=click.IntRange(min=0), default=10, help="Number of slowest source files to list in the profile. The default is 10.")
 @click.version_option()
-def cli(log_level, verbose):
+@click.pass_context
+def cli(ctx, log_level, verbose, profile, profile_output, profile_top):
     """
     threatspec - continuous threat modeling, through code
 
@@ -58,9 +68,17 @@ def cli(log_level, verbose):
     
     For more information for each subcommand use --help. For everything else,
     visit the website at https://threatspec.org
+
+    Use --profile to see where the time goes: the wall and CPU time spent in each
+    phase (loading, walking, classifying and parsing files, saving, rendering
+    reports etc.), the number of items processed and the slowest files to parse.
     """
 
     configure_logger(log_level, verbose)
+
+    if profile or profile_output:
+        profiling.profiler.enable()
+        ctx.call_on_close(lambda: report_profile(profile_output, profile_top))
     
     
 @cli.command()
@@ -98,7 +116,11 @@ def init():
 
 
 @cli.command()
-def run():
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of worker processes used to parse source files and validate imported libraries. The default is 1.")
+@click.option("--cache/--no-cache", default=False, help="Reuse annotations from threatmodel/cache.json for unchanged files.")
+@click.option("--format", "model_format", type=click.Choice(["json", "ndjson"]), default="json", help="Threat model file format. Available values: json (default), ndjson.")
+@click.option("--since", metavar="REV", help="Only parse the files changed since this git revision, keeping the other annotations from the existing threat model.")
+def run(jobs, cache, model_format, since):
     """
     Run threatspec against source code files.
 
@@ -117,17 +139,37 @@ def run():
     threatmodel/threatmodel.json file as well as the three library files:
 
     threatmodel/threats.json threatmodel/controls.json threatmodel/components.json
+
+    Use --jobs to parse source files in parallel across several worker processes.
+    The resulting files are identical to those of a serial run.
+
+    Use --cache to only parse files that have changed since the previous run. The
+    annotations found in each file are stored in threatmodel/cache.json, and files
+    with the same size and modification time or content are replayed from there.
+
+    Use --format ndjson for very large threat models. This writes
+    threatmodel/threatmodel.ndjson instead, with one record per line, as the
+    annotations are found rather than holding the whole model in memory.
+
+    Use --since to only parse the files that git reports as added, modified or
+    deleted since a revision, e.g. --since origin/main in a pull request pipeline.
+    The annotations from the other files are kept from the existing threat model.
+    All the files are parsed if there is no threat model yet or a threatspec.yaml
+    file has changed.
     """
 
     threatspec = app.ThreatSpecApp()
-    threatspec.run()
+    threatspec.run(jobs, cache, model_format, since)
 
 
 @cli.command()
-@click.option("--output", "-o", default="markdown", help="Report output format. Available values: text, json, template, markdown (default).")
-@click.option("--file", "-f", help="Output filename name. The default is set by the report mode.")
+@click.option("--output", "-o", multiple=True, default=["markdown"], help="Report output format, optionally followed by :filename. Can be repeated or comma separated. Available values: text, json, template, markdown (default).")
+@click.option("--file", "-f", help="Output filename name when a single output format is selected. The default is set by the report mode.")
 @click.option("--template", "-t", help="Template file to load if '--output template' selected.")
-def report(output, file, template):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, help="Number of worker processes used to validate imported libraries and threat models. The default is 1.")
+@click.option("--split-diagrams", is_flag=True, help="Generate one diagram per top-level component instead of a single diagram.")
+@click.option("--diagram-cache/--no-diagram-cache", default=True, help="Reuse diagrams previously rendered from the same graph, stored in threatmodel/diagram_cache. Enabled by default.")
+def report(output, file, template, jobs, split_diagrams, diagram_cache):
     """
     Generate the threatspec threat model report.
 
@@ -138,11 +180,57 @@ def report(output, file, template):
 
     This document contains tables of mitigations etc (including any tests), as
     well as connections and reviews.
+
+    Several reports can be generated from a single load of the threat model, e.g.
+    --output markdown,json:report.json,text. These are written concurrently.
+
+    Use --split-diagrams for large threat models to render a separate, smaller diagram
+    for each top-level component (the first part of component paths such as
+    App:Web:Frontend). These are laid out in parallel, and diagrams whose content
+    hasn't changed since the previous report are not rendered again.
+
+    Rendered diagrams are cached in threatmodel/diagram_cache by the hash of their
+    Graphviz source, so unchanged diagrams are copied from there rather than laid out
+    again. Use --no-diagram-cache to always render them. Images that no current
+    diagram uses are removed from the cache after each report. The cache is local to
+    your checkout, so add threatmodel/diagram_cache to your .gitignore.
     """
 
     threatspec = app.ThreatSpecApp()
-    threatspec.report(output, file, template)
-    
+    threatspec.report(output, file, template, jobs, split_diagrams, diagram_cache)
+
+
+@cli.command()
+@click.option("--output", "-o", multiple=True, help="Also write this report after each update, optionally followed by :filename. Can be repeated or comma separated. Available values: text, json, template, markdown.")
+@click.option("--template", "-t", help="Template file to load if '--output template' selected.")
+@click.option("--split-diagrams", is_flag=True, help="Generate one diagram per top-level component instead of a single diagram.")
+@click.option("--diagram-cache/--no-diagram-cache", default=True, help="Reuse diagrams previously rendered from the same graph, stored in threatmodel/diagram_cache. Enabled by default.")
+@click.option("--poll", is_flag=True, help="Check the source files for changes periodically instead of using inotify.")
+@click.option("--interval", type=click.FloatRange(min=0.01), default=0.5, help="Seconds between checks when polling. The default is 0.5.")
+@click.option("--debounce", type=click.FloatRange(min=0), default=0.1, help="Seconds to wait for further changes before updating. The default is 0.1.")
+def watch(output, template, split_diagrams, diagram_cache, poll, interval, debounce):
+    """
+    Keep the threat model up to date as source files change.
+
+    This command does a full threatspec run, then keeps the threat model and
+    libraries in memory and watches the configured source paths. When files are
+    saved, only those files are parsed again, their annotations replace the ones
+    they previously had, and threatmodel/threatmodel.json and the three library
+    files are rewritten.
+
+    Use --output to also regenerate one or more reports after each update, e.g.
+    --output markdown or --output json:report.json, with the same options as
+    threatspec report.
+
+    On Linux, changes are picked up with inotify as they happen. Elsewhere, or
+    with --poll, the source files are checked every --interval seconds. Changes
+    arriving within --debounce seconds of each other are handled together. If a
+    threatspec.yaml file changes, all the source files are parsed again.
+    """
+
+    threatspec = app.ThreatSpecApp()
+    threatspec.watch(output, template, split_diagrams, diagram_cache, poll, interval, debounce)
+
 
 if __name__ == '__main__':
     cli(None, None)
@@ -1,3 +1,6 @@
+import os
+
+
 class Project():
     def __init__(self, name: str = "", description: str = ""):
         self.name = name
@@ -21,6 +24,9 @@ class Path():
         self.path = ""
         self.ignore = ""
         self.mime = ""
+        self.extensions = {}
+        self.context_lines = 5
+        self.gitignore = False
 
         if isinstance(obj, str):
             self.path = obj
@@ -37,6 +43,34 @@ class Path():
                     raise TypeError("ignore must be a string or list")
             if "mime" in obj:
                 self.mime = obj["mime"]
+            if "extensions" in obj:
+                if not isinstance(obj["extensions"], dict):
+                    raise TypeError("extensions must be a dictionary")
+                for ext, mime in obj["extensions"].items():
+                    if not ext.startswith("."):
+                        ext = "." + ext
+                    self.extensions[ext.lower()] = mime
+            if "context_lines" in obj:
+                if isinstance(obj["context_lines"], bool) or not isinstance(obj["context_lines"], int) or obj["context_lines"] < 0:
+                    raise ValueError("context_lines must be a non-negative integer")
+                self.context_lines = obj["context_lines"]
+            if "gitignore" in obj:
+                if not isinstance(obj["gitignore"], bool):
+                    raise TypeError("gitignore must be true or false")
+                self.gitignore = obj["gitignore"]
+
+    def get_mime(self, path):
+        """Returns the configured mime type for a file, or an empty string if it should be detected."""
+        if self.mime:
+            return self.mime
+        if self.extensions:
+            _, ext = os.path.splitext(path)
+            return self.extensions.get(ext.lower(), "")
+        return ""
+
+    def get_options(self, path):
+        """Returns the configured options that affect how a file is parsed."""
+        return [self.get_mime(path), self.context_lines]
 
 
 class Config():
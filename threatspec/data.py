@@ -1,10 +1,18 @@
+import logging
+logger = logging.getLogger(__name__)
+
 import pkg_resources
 import os
 import json
 import yaml
 import shutil
 import glob
+import fnmatch
+import functools
 import jsonschema
+from threatspec import ignores
+
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 
 def cwd():
@@ -14,6 +22,14 @@ def cwd():
 def abs_path(*paths):
     return os.path.abspath(os.path.join(*paths))
 
+
+def user_cache_dir(*paths):
+    """Returns a directory for files that are specific to this machine and user, and so
+    shouldn't be written to the project: $XDG_CACHE_HOME/threatspec, or
+    ~/.cache/threatspec."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "threatspec", *paths)
+
     
 def glob_to_root(path):
     if "*" in path:
@@ -21,14 +37,146 @@ def glob_to_root(path):
     return os.path.dirname(path)
 
 
-def recurse_path(path):
+def recurse_path(path, ignore=(), gitignore=False):
+    """Yields the files in path, leaving out those matching the gitignore style ignore
+    patterns, which are relative to path, and optionally the repository's .gitignore files."""
     if os.path.isfile(path):
-        return [path]
+        base = os.path.dirname(path)
+        if not ignore_matcher(ignore, base, gitignore).path_ignored(path, base):
+            yield path
+    elif "*" in path:
+        base = glob_to_root(path)
+        matcher = ignore_matcher(ignore, base, gitignore)
+        for match in glob.iglob(path):
+            if os.path.isfile(match) and not matcher.path_ignored(match, base):
+                yield match
     else:
+        yield from walk_files(path, ignores.IgnoreMatcher(ignore, path, gitignore))
+
+
+def recurse_directories(path, ignore=(), gitignore=False):
+    """Yields the directories that recurse_path(path, ...) looks for files in."""
+    if os.path.isfile(path):
+        yield os.path.dirname(path)
+    elif "*" in path:
+        base = glob_to_root(path)
+        yield from walk_directories(base, ignore_matcher(ignore, base, gitignore))
+    else:
+        yield from walk_directories(path, ignores.IgnoreMatcher(ignore, path, gitignore))
+
+
+def select_paths(paths, path, ignore=(), gitignore=False):
+    """Yields those of the given absolute file paths that recurse_path(path, ...) would
+    yield, without walking path. The paths are yielded in sorted order."""
+    if "*" in path:
+        base = glob_to_root(path)
+    elif os.path.isfile(path):
+        base = os.path.dirname(path)
+    else:
+        base = path
+    real_base = os.path.realpath(base)
+    matcher = ignore_matcher(ignore, base, gitignore)
+
+    for changed in sorted(paths):
+        relative = os.path.relpath(changed, real_base)
+        if relative == os.curdir or relative.startswith(os.pardir + os.sep) or relative == os.pardir:
+            continue
+        candidate = os.path.join(base, relative)
         if "*" in path:
-            return glob.iglob(path)
-        else:
-            return glob.iglob(os.path.join(path, "**/*"), recursive=True)
+            if not glob_match(candidate, path):
+                continue
+        elif os.path.isfile(path):
+            if os.path.realpath(path) != changed:
+                continue
+        elif any(part.startswith(".") for part in relative.split(os.sep)):
+            continue
+        if os.path.isfile(candidate) and not matcher.path_ignored(candidate, base):
+            yield candidate
+
+
+def directory_selected(directory, path, ignore=(), gitignore=False):
+    """Checks whether recurse_directories(path, ...) would yield directory, without
+    walking path."""
+    if os.path.isfile(path):
+        return directory == os.path.dirname(path)
+    base = glob_to_root(path) if "*" in path else path
+    relative = os.path.relpath(directory, base)
+    if relative == os.curdir:
+        return True
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return False
+    if any(part.startswith(".") for part in relative.split(os.sep)):
+        return False
+    return not ignore_matcher(ignore, base, gitignore).path_ignored(directory, base)
+
+
+def glob_match(path, pattern):
+    """Checks whether glob.iglob(pattern) would find path, without listing directories."""
+    parts = path.split(os.sep)
+    pattern_parts = pattern.split(os.sep)
+    if len(parts) != len(pattern_parts):
+        return False
+    for (part, pattern_part) in zip(parts, pattern_parts):
+        if part.startswith(".") and not pattern_part.startswith("."):
+            return False
+        if not fnmatch.fnmatchcase(part, pattern_part):
+            return False
+    return True
+
+
+def ignore_matcher(ignore, base, gitignore=False):
+    matcher = ignores.IgnoreMatcher(ignore, base, gitignore)
+    if gitignore and os.path.isfile(os.path.join(base, ".gitignore")):
+        matcher = matcher.for_directory(base)
+    return matcher
+
+
+def walk_files(path, matcher=None):
+    """Yields the files under path, in the same order as a recursive glob and likewise
+    skipping hidden files and directories. Ignored directories are not descended into,
+    and the file types come from the directory listing rather than a stat per file."""
+    for (entry_path, is_dir) in walk(path, matcher):
+        if not is_dir:
+            yield entry_path
+
+
+def walk_directories(path, matcher=None):
+    """Yields path and the directories under it that walk_files would descend into."""
+    yield path
+    for (entry_path, is_dir) in walk(path, matcher):
+        if is_dir:
+            yield entry_path
+
+
+def walk(path, matcher=None):
+    directories = [(path, matcher)]
+    while directories:
+        (directory, matcher) = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        if matcher and matcher.gitignore and any(entry.name == ".gitignore" for entry in entries):
+            matcher = matcher.for_directory(directory)
+
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                is_dir = entry.is_dir()
+                if matcher and matcher.ignored(entry.path, is_dir):
+                    logger.debug("Skipping ignored path: {}".format(entry.path))
+                elif is_dir:
+                    subdirectories.append((entry.path, matcher))
+                    yield (entry.path, True)
+                elif entry.is_file():
+                    yield (entry.path, False)
+            except OSError:
+                continue
+        directories.extend(reversed(subdirectories))
 
 
 def blacklisted_path(path):
@@ -49,13 +197,6 @@ def blacklisted_path(path):
     return False
     
     
-def path_ignored(path, ignore):
-    for i in ignore:
-        if i in path:
-            return True
-    return False
-
-
 def is_threatspec_path(path):
     return os.path.isfile(os.path.join(path, "threatspec.yaml"))
 
@@ -68,10 +209,17 @@ def create_directories(paths):
             pass
 
 
-def write_json_pretty(data, *path):
+def remove_file(*path):
+    try:
+        os.remove(os.path.join(*path))
+    except FileNotFoundError:
+        pass
+
+
+def write_json_pretty(data, *path, default=None):
     path = os.path.join(*path)
     with open(path, 'w') as fh:
-        json.dump(data, fh, indent=2)
+        json.dump(data, fh, indent=2, default=default)
 
 
 def read_json(*path):
@@ -80,12 +228,40 @@ def read_json(*path):
         return json.load(fh)
 
 
+def read_ndjson(*path):
+    path = os.path.join(*path)
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
 def write_file(data, *path):
     path = os.path.join(*path)
     with open(path, 'w') as fh:
         fh.write(data)
 
 
+def write_bytes(data, *path):
+    path = os.path.join(*path)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+
+def write_stream(chunks, *path):
+    """Writes an iterable of strings, e.g. from a template's generate(), without
+    holding the whole text in memory. The file is only replaced once complete."""
+    path = os.path.join(*path)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w', buffering=WRITE_BUFFER_SIZE) as fh:
+            fh.writelines(chunks)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
 def read_yaml(*path):
     path = os.path.join(*path)
     with open(path) as fh:
@@ -98,17 +274,68 @@ def write_yaml(data, *path):
         fh.write(yaml.dump(data))
 
 
+@functools.lru_cache(maxsize=None)
+def load_schema(schema_file):
+    return read_json(resolve_pkg_file(schema_file))
+
+
+@functools.lru_cache(maxsize=None)
+def schema_validator(schema_file, definition=None):
+    """Returns a compiled validator for a schema, or for one of its definitions, checked and built once per process."""
+    schema = load_schema(schema_file)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    if definition:
+        schema = {"$ref": "#/definitions/{}".format(definition), "definitions": schema["definitions"]}
+    return validator_class(schema)
+
+
+def validate(document, schema_file, definition=None):
+    error = jsonschema.exceptions.best_match(schema_validator(schema_file, definition).iter_errors(document))
+    if error:
+        raise error
+
+
 def validate_yaml_file(file_path, schema_file):
     if not os.path.isfile(file_path):
         return (True, None)
-    schema_path = resolve_pkg_file(schema_file)
     try:
-        jsonschema.validate(read_yaml(file_path), read_yaml(schema_path))
+        validate(read_yaml(file_path), schema_file)
     except jsonschema.exceptions.ValidationError as e:
         return (False, str(e))
     return (True, None)
 
-    
+
+def read_validated_json(file_path, schema_file):
+    """Reads and validates a JSON file in one pass, returning (document, error).
+
+    The document is None if the file doesn't exist or isn't valid.
+    """
+    try:
+        document = read_json(file_path)
+    except FileNotFoundError:
+        return (None, None)
+    except ValueError as e:
+        return (None, str(e))
+
+    try:
+        validate(document, schema_file)
+    except jsonschema.exceptions.ValidationError as e:
+        return (None, str(e))
+    return (document, None)
+
+
+def validate_ndjson_records(records, schema_file):
+    """Validate each NDJSON record as it is read, against the schema definition named by its kind."""
+    definitions = load_schema(schema_file)["definitions"]
+    for record in records:
+        kind = record.get("kind")
+        if kind not in definitions:
+            raise jsonschema.exceptions.ValidationError("Unknown record kind {}".format(kind))
+        validate(record, schema_file, kind)
+        yield record
+
+
 def resolve_pkg_file(*path):
     return pkg_resources.resource_filename("threatspec", os.path.join(*path))
 
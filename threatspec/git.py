@@ -0,0 +1,33 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import subprocess
+
+
+class GitError(Exception):
+    pass
+
+
+def git(path, *args):
+    try:
+        result = subprocess.run(["git"] + list(args), cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except FileNotFoundError:
+        raise GitError("git executable not found")
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.decode("utf-8", errors="replace").strip())
+    return result.stdout.decode("utf-8", errors="surrogateescape")
+
+
+def toplevel(path):
+    return git(path, "rev-parse", "--show-toplevel").strip()
+
+
+def changed_files(path, rev):
+    """Returns the absolute paths of the files in the repository containing path that
+    were added, modified or deleted since rev, including uncommitted changes and new
+    untracked files. Renames are reported as the old and the new path."""
+    root = toplevel(path)
+    changed = git(root, "diff", "--name-only", "--no-renames", "-z", rev, "--").split("\0")
+    changed += git(root, "ls-files", "--others", "--exclude-standard", "-z").split("\0")
+    return set(os.path.normpath(os.path.join(root, p)) for p in changed if p)
@@ -0,0 +1,182 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import re
+
+
+def translate(pattern):
+    """Translates a gitignore glob into a regular expression matching '/' separated
+    relative paths. * and ? don't match '/', and ** matches any number of directories
+    when it is a whole path component."""
+    i = 0
+    n = len(pattern)
+    regex = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+                if i + 2 == n:
+                    regex.append(".+")
+                    i += 2
+                    continue
+                if pattern[i + 2] == "/":
+                    regex.append("(?:.*/)?")
+                    i += 3
+                    continue
+            while i + 1 < n and pattern[i + 1] == "*":
+                i += 1
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                regex.append(re.escape(c))
+            else:
+                chars = pattern[i + 1:j].replace("\\", "\\\\")
+                if chars[0] in "!^":
+                    chars = "^" + chars[1:]
+                regex.append("[{}]".format(chars))
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
+
+
+class IgnoreRules():
+    """A list of gitignore patterns, relative to the base directory they apply to.
+
+    The patterns are compiled into one regular expression, with the alternatives in
+    reverse order so that the first one to match is the last matching pattern, which
+    decides whether the path is ignored. Files use a second one without the patterns
+    that only match directories.
+    """
+
+    def __init__(self, patterns, base):
+        self.base = base
+
+        rules = []
+        for pattern in patterns:
+            pattern = pattern.rstrip("\n")
+            if not pattern.endswith("\\ "):
+                pattern = pattern.rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+                pattern = pattern[1:]
+
+            directory_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+
+            # Patterns containing a separator are relative to the base, others match at any level
+            if "/" in pattern:
+                regex = translate(pattern.lstrip("/"))
+            else:
+                regex = "(?:.*/)?" + translate(pattern)
+            rules.append((regex, negated, directory_only))
+
+        rules.reverse()
+        (self.directory_regex, self.directory_negated) = self.compile(rules)
+        (self.file_regex, self.file_negated) = self.compile([rule for rule in rules if not rule[2]])
+
+    @staticmethod
+    def compile(rules):
+        if not rules:
+            return (None, [])
+        regex = re.compile("(?:{})\\Z".format("|".join("({})".format(rule[0]) for rule in rules)), re.DOTALL)
+        return (regex, [rule[1] for rule in rules])
+
+    @classmethod
+    def from_file(cls, filename):
+        try:
+            with open(filename, errors="replace") as fh:
+                return cls(fh.readlines(), os.path.dirname(filename))
+        except OSError as e:
+            logger.warn("Couldn't read ignore file {}: {}".format(filename, str(e)))
+            return cls([], os.path.dirname(filename))
+
+    def match(self, path, is_dir=False):
+        """Returns True if the path is ignored, False if it is explicitly included with a
+        negated pattern, or None if no pattern matches it."""
+        if is_dir:
+            (regex, negated) = (self.directory_regex, self.directory_negated)
+        else:
+            (regex, negated) = (self.file_regex, self.file_negated)
+        if regex is None:
+            return None
+
+        relative = path[len(self.base):].lstrip(os.sep)
+        if os.sep != "/":
+            relative = relative.replace(os.sep, "/")
+
+        m = regex.match(relative)
+        if not m:
+            return None
+        return not negated[m.lastindex - 1]
+
+
+class IgnoreMatcher():
+    """The ignore rules that apply within a directory: the path's configured ignore
+    patterns and, optionally, any .gitignore files from the repository root down. The
+    configured patterns take precedence, then the deepest .gitignore file."""
+
+    def __init__(self, patterns, base, gitignore=False, gitignore_rules=None):
+        self.patterns = patterns if isinstance(patterns, IgnoreRules) else IgnoreRules(patterns, base)
+        self.gitignore = gitignore
+        if gitignore_rules is None:
+            gitignore_rules = [IgnoreRules.from_file(os.path.join(d, ".gitignore")) for d in self.repository_directories(base)] if gitignore else []
+        self.gitignore_rules = gitignore_rules
+        self.rules = [self.patterns] + list(reversed(gitignore_rules))
+
+    @staticmethod
+    def repository_directories(base):
+        """Returns the directories above base, up to the root of the git repository
+        containing it, that have a .gitignore file."""
+        directories = []
+        directory = os.path.abspath(base)
+        while not os.path.exists(os.path.join(directory, ".git")):
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return []
+            directory = parent
+            if os.path.isfile(os.path.join(directory, ".gitignore")):
+                directories.append(directory)
+        directories.reverse()
+        return directories
+
+    def for_directory(self, directory):
+        """Returns the matcher for a sub-directory that has a .gitignore file."""
+        if not self.gitignore:
+            return self
+        rules = IgnoreRules.from_file(os.path.join(directory, ".gitignore"))
+        return IgnoreMatcher(self.patterns, directory, True, self.gitignore_rules + [rules])
+
+    def ignored(self, path, is_dir=False):
+        for rules in self.rules:
+            result = rules.match(path, is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def path_ignored(self, path, base):
+        """Checks each directory between base and path, as well as path itself, for paths
+        that weren't found by walking the directories."""
+        relative = os.path.relpath(path, base)
+        if relative.startswith(os.pardir):
+            return self.ignored(path)
+        parts = relative.split(os.sep)
+        for i in range(1, len(parts)):
+            if self.ignored(os.path.join(base, *parts[:i]), True):
+                return True
+        return self.ignored(path, os.path.isdir(path))
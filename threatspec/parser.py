@@ -1,11 +1,134 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import io
 import os
 import re
+import mmap
 import yaml
 import json
 from comment_parser import comment_parser
+from threatspec import profiling
+
+PATTERNS = {
+    "mitigate": r'@mitigates? (?P<component>.*?) against (?P<threat>.*?) with (?P<control>.*)',
+    "accept": r'@accepts? (?P<threat>.*?) to (?P<component>.*?) with (?P<details>.*)',
+    "transfer": r'@transfers? (?P<threat>.*?) from (?P<source_component>.*?) to (?P<destination_component>.*?) with (?P<details>.*)',
+    "expose": r'@exposes? (?P<component>.*?) to (?P<threat>.*?) with (?P<details>.*)',
+    "connect": r'@connects? (?P<source_component>.*?) (?P<direction>with|to) (?P<destination_component>.*?) with (?P<details>.*)',
+    "review": r'@reviews? (?P<component>.*?) (?P<details>.*)',
+    "test": r'@tests? (?P<control>.*?) for (?P<component>.*)',
+
+    "threat": r'@threat (?P<threat>.*)',
+    "control": r'@control (?P<control>.*)',
+    "component": r'@component (?P<component>.*)'
+}
+
+ANNOTATION_KEYWORDS = re.compile("@(?:{})".format("|".join(PATTERNS.keys())).encode())
+
+STARS = re.compile(r"\s*\*+")
+UNSTARRED_MIME_TYPES = {"text/html", "text/x-shellscript", "text/xml"}
+
+
+class AnnotationMatcher():
+    """Recognises the action of an annotation line and matches its pattern.
+
+    The action keyword is found with a single anchored alternation, then only that
+    action's pattern is tried. All patterns are compiled once, when the module loads.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.keywords = re.compile("@({})".format("|".join(patterns.keys())))
+        self.compiled = {}
+        for action, pattern in patterns.items():
+            self.compiled[action] = re.compile(pattern, re.M | re.I)
+
+    def action(self, line):
+        m = self.keywords.match(line)
+        if m:
+            return m.group(1)
+        return None
+
+    def match(self, action, line):
+        return self.compiled[action].match(line)
+
+
+matcher = AnnotationMatcher(PATTERNS)
+
+
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def read_source(filename):
+    """Read a file once, returning its raw contents if it may contain annotations.
+
+    The raw bytes are checked for any annotation keyword first, and None is returned
+    for files that can't contain annotations. Large files are memory-mapped so the
+    check doesn't need its own copy of the file.
+    """
+    with open(filename, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size < MMAP_THRESHOLD:
+            content = fh.read()
+            if ANNOTATION_KEYWORDS.search(content) is None:
+                return None
+            return content
+
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if ANNOTATION_KEYWORDS.search(mm) is None:
+                return None
+            return mm[:]
+
+
+def decode_source(content):
+    """Decode raw file contents the same way open() does in text mode, including universal newlines."""
+    return io.TextIOWrapper(io.BytesIO(content), encoding="utf-8").read()
+
+
+class AnnotationRecorder():
+    """Stands in for a ThreatModel and records annotations instead of adding them.
+
+    The recorded (data, source) pairs are plain dicts, so they can be sent back
+    from worker processes and replayed into a real ThreatModel with Parser.run_action.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, action, data, source):
+        data = dict(data)
+        data["action"] = action
+        self.records.append((data, dict(source)))
+
+    def add_mitigation(self, data, source):
+        self.record("mitigate", data, source)
+
+    def add_acceptance(self, data, source):
+        self.record("accept", data, source)
+
+    def add_transfer(self, data, source):
+        self.record("transfer", data, source)
+
+    def add_exposure(self, data, source):
+        self.record("expose", data, source)
+
+    def add_connection(self, data, source):
+        self.record("connect", data, source)
+
+    def add_review(self, data, source):
+        self.record("review", data, source)
+
+    def add_test(self, data, source):
+        self.record("test", data, source)
+
+    def add_threat(self, data, source):
+        self.record("threat", data, source)
+
+    def add_control(self, data, source):
+        self.record("control", data, source)
+
+    def add_component(self, data, source):
+        self.record("component", data, source)
 
 
 class Parser():
@@ -25,18 +148,8 @@ class Parser():
         self.action_table["control"] = self.threatmodel.add_control
         self.action_table["component"] = self.threatmodel.add_component
 
-        self.patterns = {}
-        self.patterns["mitigate"] = r'@mitigates? (?P<component>.*?) against (?P<threat>.*?) with (?P<control>.*)'
-        self.patterns["accept"] = r'@accepts? (?P<threat>.*?) to (?P<component>.*?) with (?P<details>.*)'
-        self.patterns["transfer"] = r'@transfers? (?P<threat>.*?) from (?P<source_component>.*?) to (?P<destination_component>.*?) with (?P<details>.*)'
-        self.patterns["expose"] = r'@exposes? (?P<component>.*?) to (?P<threat>.*?) with (?P<details>.*)'
-        self.patterns["connect"] = r'@connects? (?P<source_component>.*?) (?P<direction>with|to) (?P<destination_component>.*?) with (?P<details>.*)'
-        self.patterns["review"] = r'@reviews? (?P<component>.*?) (?P<details>.*)'
-        self.patterns["test"] = r'@tests? (?P<control>.*?) for (?P<component>.*)'
-
-        self.patterns["threat"] = r'@threat (?P<threat>.*)'
-        self.patterns["control"] = r'@control (?P<control>.*)'
-        self.patterns["component"] = r'@component (?P<component>.*)'
+        self.patterns = PATTERNS
+        self.matcher = matcher
 
         self.cwd = os.getcwd()
 
@@ -53,6 +166,12 @@ class Parser():
                 return True
         return False
 
+    def read_file(self, filename, content=None):
+        if content is None:
+            with open(filename, "rb") as fh:
+                content = fh.read()
+        return decode_source(content)
+
     def check_file(self, filename):
         logger.debug("Parsing file {}".format(filename))
         if filename.startswith(self.cwd):
@@ -80,21 +199,20 @@ class CommentParser(Parser):
         for line in comment.split("\n"):
             stripped_line = self.strip(line)
             if state == LINE:
-                for action in self.patterns.keys():
-                    if stripped_line.startswith("@" + action):
-                        data = {"action": action, "line": line_number, "annotation": stripped_line}
-                        extended_lines = []
-                        pattern = self.patterns[action]
-                        if self.is_extended(stripped_line):
-                            state = EXTENDED
-                            stripped_line = stripped_line[0:-1]
-                        m = re.match(pattern, stripped_line, re.M | re.I)
-                        if m:
-                            data.update(m.groupdict())
-                            if state == LINE:
-                                annotations.append(data)
-                        else:
-                            raise Exception("Could not parse {} pattern:\n{} for comment line:\n{}".format(action, pattern, line))
+                action = self.matcher.action(stripped_line)
+                if action:
+                    data = {"action": action, "line": line_number, "annotation": stripped_line}
+                    extended_lines = []
+                    if self.is_extended(stripped_line):
+                        state = EXTENDED
+                        stripped_line = stripped_line[0:-1]
+                    m = self.matcher.match(action, stripped_line)
+                    if m:
+                        data.update(m.groupdict())
+                        if state == LINE:
+                            annotations.append(data)
+                    else:
+                        raise Exception("Could not parse {} pattern:\n{} for comment line:\n{}".format(action, self.patterns[action], line))
 
             elif state == EXTENDED:
                 if stripped_line == "":
@@ -121,17 +239,16 @@ class CommentParser(Parser):
         return self.strip_stars(line).strip()
 
     def strip_stars(self, line):
-        if self.mime not in ["text/html", "text/x-shellscript", "text/xml"]:
-            return re.sub(r"\s*\*+", "", line)
+        if self.mime not in UNSTARRED_MIME_TYPES:
+            return STARS.sub("", line)
         return line
 
       
 class TextFileParser(CommentParser):
-    def parse_file(self, filename):
+    def parse_file(self, filename, content=None):
         filename = self.check_file(filename)
 
-        with open(filename) as fh:
-            data = fh.read()
+        data = self.read_file(filename, content)
 
         source = {
             "filename": filename,
@@ -146,21 +263,22 @@ class TextFileParser(CommentParser):
 
 class SourceFileParser(CommentParser):
 
-    def __init__(self, threatmodel, mime=None):
+    def __init__(self, threatmodel, mime=None, context_lines=5):
         super().__init__(threatmodel)
         self.mime = mime
+        self.context_lines = context_lines
 
     def extract_comment_context(self, lines, commented_lines, start_line, num_lines, multiline=False):
         count = 0
-        i = start_line
         code = []
 
         capture_first_line = not multiline
 
-        for line in lines[start_line - 1:]:
+        for i in range(start_line, len(lines) + 1):
             if count >= num_lines:
-                return "".join(code)
+                break
 
+            line = lines[i - 1]
             if capture_first_line:
                 code.append(line)
                 capture_first_line = False
@@ -168,35 +286,36 @@ class SourceFileParser(CommentParser):
             if i not in commented_lines:
                 code.append(line)
                 count += 1
-            i += 1
         return "".join(code)
 
-    def get_lines(self, filename):
-        try:
-            with open(filename) as fh:
-                return fh.readlines()
-        except UnicodeDecodeError:
-            return None
+    def get_lines(self, text):
+        return io.StringIO(text).readlines()
 
-    def parse_file(self, filename):
+    def parse_file(self, filename, content=None):
         logger.debug("Parsing file {}".format(filename))
 
-        lines = self.get_lines(filename)
+        try:
+            text = self.read_file(filename, content)
+        except UnicodeDecodeError:
+            return
+        lines = self.get_lines(text)
         if not lines:
             return
 
-        commented_line_numbers = []
+        commented_line_numbers = set()
         comments = []
         try:
-            for comment in comment_parser.extract_comments(filename, self.mime):
+            with profiling.phase("comment extraction"):
+                extracted = comment_parser.extract_comments_from_str(text, self.mime)
+            for comment in extracted:
                 comment_text = comment.text()
                 comment_line = comment.line_number()
                 if comment.is_multiline():
                     offset = len(comment_text.split("\n"))
-                    commented_line_numbers += range(comment_line, comment_line + offset)
+                    commented_line_numbers.update(range(comment_line, comment_line + offset))
                 else:
                     offset = 0
-                    commented_line_numbers.append(comment_line)
+                    commented_line_numbers.add(comment_line)
                 comments.append({
                     "text": comment_text,
                     "line": comment_line,
@@ -209,8 +328,7 @@ class SourceFileParser(CommentParser):
 
         for comment in comments:
             comment["text"] = comment["text"].strip()
-            num_lines = 5  # Get 5 lines of code
-            code = self.extract_comment_context(lines, commented_line_numbers, comment["line"] + comment["offset"], num_lines, comment["multiline"])
+            code = self.extract_comment_context(lines, commented_line_numbers, comment["line"] + comment["offset"], self.context_lines, comment["multiline"])
 
             source = {
                 "code": code,
@@ -226,18 +344,19 @@ class SourceFileParser(CommentParser):
 
 
 class YamlFileParser(Parser):
-    def parse_annotation(self, annotation, data={}):
+    def parse_annotation(self, annotation, data=None):
+        if data is None:
+            data = {}
         stripped_line = annotation.strip()
-        for action in self.patterns.keys():
-            if stripped_line.startswith("@" + action):
-                data["action"] = action
-                pattern = self.patterns[action]
-                m = re.match(pattern, stripped_line, re.M | re.I)
-                if m:
-                    data.update(m.groupdict())
-                    return data
-                else:
-                    raise Exception("Could not parse {} pattern:\n{} for comment line:\n{}".format(action, pattern, stripped_line))
+        action = self.matcher.action(stripped_line)
+        if action:
+            data["action"] = action
+            m = self.matcher.match(action, stripped_line)
+            if m:
+                data.update(m.groupdict())
+                return data
+            else:
+                raise Exception("Could not parse {} pattern:\n{} for comment line:\n{}".format(action, self.patterns[action], stripped_line))
 
     def parse_key(self, data, parent, filename):
         if isinstance(data, str):
@@ -283,9 +402,8 @@ class YamlFileParser(Parser):
             for v in data:
                 self.parse_data(v, data, filename)
 
-    def parse_file(self, filename):
+    def parse_file(self, filename, content=None):
         filename = self.check_file(filename)
 
-        with open(filename) as fh:
-            file_data = yaml.load(fh, Loader=yaml.SafeLoader)
-            self.parse_data(file_data, {}, filename)
+        file_data = yaml.load(self.read_file(filename, content), Loader=yaml.SafeLoader)
+        self.parse_data(file_data, {}, filename)
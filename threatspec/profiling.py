@@ -0,0 +1,176 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import json
+import threading
+
+thread_time = getattr(time, "thread_time", time.process_time)
+
+
+class Phase():
+    __slots__ = ("name", "wall", "cpu", "calls", "items")
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.items = 0
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "calls": self.calls,
+            "items": self.items
+        }
+
+
+class Timer():
+    """Times one call of a phase. Time spent in phases nested within it on the same
+    thread is only counted against the nested phase."""
+
+    __slots__ = ("profiler", "name", "items", "wall", "cpu", "child_wall", "child_cpu")
+
+    def __init__(self, profiler, name, items):
+        self.profiler = profiler
+        self.name = name
+        self.items = items
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+    def __enter__(self):
+        self.profiler.register(self.name)
+        self.profiler.stack().append(self)
+        self.wall = time.perf_counter()
+        self.cpu = thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = thread_time() - self.cpu
+        stack = self.profiler.stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+        self.profiler.add(self.name, wall - self.child_wall, cpu - self.child_cpu, self.items)
+        return False
+
+
+class NullTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Profiler():
+    """Wall time, CPU time and item counts for each phase of a run, plus the time taken
+    to parse each source file. Nothing is recorded unless the profiler is enabled."""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.files = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.start = time.perf_counter()
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def phase(self, name, items=1):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, items)
+
+    def register(self, name):
+        # Phases are listed in the order they first start
+        if name not in self.phases:
+            with self.lock:
+                if name not in self.phases:
+                    self.phases[name] = Phase(name)
+
+    def add(self, name, wall, cpu, items=1):
+        with self.lock:
+            phase = self.phases[name]
+            phase.wall += wall
+            phase.cpu += cpu
+            phase.calls += 1
+            phase.items += items
+
+    def file(self, path, seconds):
+        if self.enabled:
+            with self.lock:
+                self.files.append((seconds, path))
+
+    def slowest_files(self, count):
+        return sorted(self.files, reverse=True)[:count]
+
+    def summary(self, top=10):
+        total = time.perf_counter() - self.start
+        lines = ["{:<24} {:>10} {:>10} {:>8} {:>10}".format("Phase", "Wall (s)", "CPU (s)", "Wall %", "Items")]
+        for phase in self.phases.values():
+            lines.append("{:<24} {:>10.3f} {:>10.3f} {:>7.1f}% {:>10}".format(
+                phase.name, phase.wall, phase.cpu, 100 * phase.wall / total if total else 0, phase.items))
+        lines.append("{:<24} {:>10.3f}".format("Total", total))
+
+        files = self.slowest_files(top)
+        if files:
+            lines.append("")
+            lines.append("Slowest files to parse:")
+            for (seconds, path) in files:
+                lines.append("{:>10.3f}  {}".format(seconds, path))
+        return "\n".join(lines)
+
+    def trace(self, top=10):
+        return {
+            "total": time.perf_counter() - self.start,
+            "phases": [phase.as_dict() for phase in self.phases.values()],
+            "slowest_files": [{"filename": path, "wall": seconds} for (seconds, path) in self.slowest_files(top)]
+        }
+
+    def write_trace(self, filename, top=10):
+        with open(filename, "w") as fh:
+            json.dump(self.trace(top), fh, indent=2)
+
+
+profiler = Profiler()
+
+
+def phase(name, items=1):
+    return profiler.phase(name, items)
+
+
+def timed(name, iterable):
+    """Yields from iterable, counting the time spent producing each item against name."""
+    if not profiler.enabled:
+        yield from iterable
+        return
+
+    iterator = iter(iterable)
+    while True:
+        with profiler.phase(name) as timer:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                timer.items = 0
+                return
+        yield item
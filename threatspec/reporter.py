@@ -1,16 +1,54 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from threatspec import data, threatmodel, config
-from jinja2 import Environment, FileSystemLoader, PackageLoader
+from threatspec import data, profiling, threatmodel, config
+from jinja2 import Environment, FileSystemLoader, PackageLoader, FileSystemBytecodeCache
 from graphviz import Digraph
 import os
-import uuid
+import re
+import shutil
+import hashlib
 import textwrap
-
-
-def random_id():
-    return uuid.uuid4().hex
+import threading
+import functools
+import concurrent.futures
+from collections.abc import Mapping, Sequence
+from collections import ChainMap
+
+
+bytecode_cache = None
+
+# Held while a diagram manifest is updated, so that reports written concurrently don't
+# lose each other's entries or prune images that another report is still using
+diagram_lock = threading.Lock()
+
+
+def set_template_cache(*path):
+    """Stores compiled templates in the given directory so later runs don't have to
+    compile them again. Must be called before any template is loaded."""
+    global bytecode_cache
+    directory = os.path.join(*path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        logger.warn("Couldn't create the template cache {}, templates will be compiled on every run: {}".format(directory, str(e)))
+        return
+    bytecode_cache = FileSystemBytecodeCache(directory)
+    template_environment.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def template_environment(template_dir=None):
+    """Returns the shared environment for the built-in templates, or for the templates
+    in template_dir. Compiled templates are kept by the environment and reused."""
+    if template_dir is None:
+        template_loader = PackageLoader('threatspec', 'report_templates')
+    else:
+        template_loader = FileSystemLoader(template_dir)
+    env = Environment(loader=template_loader, bytecode_cache=bytecode_cache)
+    # The report data is made of views rather than dicts and lists, so tojson needs to convert them
+    env.policies["json.dumps_kwargs"] = {"default": json_default, "sort_keys": True}
+    return env
 
 
 def left_align(text):
@@ -69,87 +107,194 @@ def code(block, width=None):
     return "\n".join(new_lines)
 
 
-class DataReporter():
+class ObjectView(Mapping):
+    """Read-only mapping over a model object, laid out like the dict from its as_dict().
 
-    def __init__(self, project: config.Project, threatmodel: threatmodel.ThreatModel):
-        self.project = project
-        self.threatmodel = threatmodel
-        self.data = None
-        self.build_report()
+    Reports and templates can use it like that dict, by key or by attribute, without
+    the object being copied.
+    """
+    __slots__ = ("_obj", "_fields")
 
-    def build_report(self):
-        threat_library = self.threatmodel.threat_library.save()
-        control_library = self.threatmodel.control_library.save()
-        component_library = self.threatmodel.component_library.save()
+    def __init__(self, obj, fields=None):
+        self._obj = obj
+        # The slots of the model classes are declared in as_dict() order
+        self._fields = fields or type(obj).__slots__
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self._obj, key)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getattr__(self, key):
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+
+class RecordView(ObjectView):
+    """View of a mitigation, exposure etc. with its references resolved against the report's libraries."""
+    __slots__ = ("_report",)
+
+    references = {
+        "threat": "threats",
+        "control": "controls",
+        "component": "components",
+        "source_component": "components",
+        "destination_component": "components"
+    }
+
+    def __init__(self, record, report, with_tests=True):
+        fields = type(record).__slots__
+        if with_tests:
+            fields = fields + ("tests",)
+        super().__init__(record, fields)
+        self._report = report
+
+    def __getitem__(self, key):
+        if key == "tests" and key in self._fields:
+            return self._report.tests_for(self._obj)
+        value = super().__getitem__(key)
+        if key == "source":
+            return ObjectView(value)
+        if key in self.references:
+            return self._report.resolve(self.references[key], value)
+        return value
+
+
+class RecordList(Sequence):
+    __slots__ = ("_records", "_report", "_with_tests")
+
+    def __init__(self, records, report, with_tests=True):
+        self._records = records
+        self._report = report
+        self._with_tests = with_tests
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RecordView(record, self._report, self._with_tests) for record in self._records[index]]
+        return RecordView(self._records[index], self._report, self._with_tests)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+
+class ReportData(Mapping):
+    """The report data, as a view over the live threat model and libraries.
+
+    The threats, controls and components used by the model are collected in a
+    single pass. Everything else is resolved when it is read. Internal attributes are
+    private so they can't shadow report keys in templates.
+    """
+
+    def __init__(self, project: config.Project, threatmodel: threatmodel.ThreatModel):
+        self._threatmodel = threatmodel
+        self._libraries = {
+            "threats": threatmodel.threat_library.threats,
+            "controls": threatmodel.control_library.controls,
+            "components": threatmodel.component_library.components
+        }
+        self._tests = {}
 
-        self.data = {
+        self._values = {
             "project": {
-                "name": self.project.name,
-                "description": self.project.description
+                "name": project.name,
+                "description": project.description
+            },
+            "threatmodel": {
+                "mitigations": RecordList(threatmodel.mitigations, self),
+                "exposures": RecordList(threatmodel.exposures, self),
+                "transfers": RecordList(threatmodel.transfers, self),
+                "acceptances": RecordList(threatmodel.acceptances, self),
+                "connections": RecordList(threatmodel.connections, self),
+                "reviews": RecordList(threatmodel.reviews, self),
+                "tests": RecordList(threatmodel.tests, self, with_tests=False),
+                "run_id": threatmodel.run_id
             },
-            "threatmodel": self.threatmodel.save(),
             "threats": {},
             "controls": {},
             "components": {}
         }
+        self.collect_references()
+
+    def collect_references(self):
+        for test in self._threatmodel.tests:
+            self.add_reference("components", test.component)
+            self.add_reference("controls", test.control)
+
+        for records in [self._threatmodel.mitigations, self._threatmodel.exposures, self._threatmodel.transfers,
+                        self._threatmodel.acceptances, self._threatmodel.connections, self._threatmodel.reviews]:
+            for record in records:
+                for key, kind in RecordView.references.items():
+                    if hasattr(record, key):
+                        self.add_reference(kind, getattr(record, key))
+
+    def add_reference(self, kind, id):
+        if id in self._values[kind]:
+            return
+        entry = self._libraries[kind].get(id)
+        if entry and entry.run_id:  # Only saved library entries are included
+            self._values[kind][id] = ObjectView(entry)
+
+    def resolve(self, kind, id):
+        return self._values[kind].get(id, id)
+
+    def tests_for(self, record):
+        control_id = getattr(record, "control", None)
+        component_id = getattr(record, "component", None)
+        if not control_id or component_id not in self._values["components"]:
+            return []
+        key = (component_id, control_id)
+        if key not in self._tests:
+            tests = self._threatmodel.tests_for(component_id, control_id)
+            self._tests[key] = RecordList(tests, self, with_tests=False)
+        return self._tests[key]
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+
+def json_default(obj):
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, Sequence):
+        return list(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
 
-        tests_by_component_control = {}
-        for test in self.data["threatmodel"]["tests"]:
-            component_id = test["component"]
-            control_id = test["control"]
-
-            if component_id in component_library["components"]:
-                test["component"] = component_library["components"][component_id]
-                if component_id not in self.data["components"]:
-                    self.data["components"][component_id] = component_library["components"][component_id]
-            if component_id not in tests_by_component_control:
-                tests_by_component_control[component_id] = {}
-
-            if control_id in control_library["controls"]:
-                test["control"] = control_library["controls"][control_id]
-                if control_id not in self.data["controls"]:
-                    self.data["controls"][control_id] = control_library["controls"][control_id]
-            if control_id not in tests_by_component_control[component_id]:
-                tests_by_component_control[component_id][control_id] = []
-
-            tests_by_component_control[component_id][control_id].append(test)
-
-        for key, arr in self.data["threatmodel"].items():
-            if key == "tests":
-                continue  # Tests are processed separately above
-            if isinstance(arr, list):
-                for obj in arr:
-                    if not isinstance(obj, dict):
-                        continue
-
-                    if "tests" not in obj:
-                        obj["tests"] = []
-
-                    if "threat" in obj:
-                        threat_id = obj["threat"]
-                        if threat_id in threat_library["threats"]:
-                            obj["threat"] = threat_library["threats"][threat_id]
-                            if threat_id not in self.data["threats"]:
-                                self.data["threats"][threat_id] = threat_library["threats"][threat_id]
-
-                    control_id = None
-                    if "control" in obj:
-                        control_id = obj["control"]
-                        if control_id in control_library["controls"]:
-                            obj["control"] = control_library["controls"][control_id]
-                            if control_id not in self.data["controls"]:
-                                self.data["controls"][control_id] = control_library["controls"][control_id]
-
-                    for component_key in ["component", "source_component", "destination_component"]:
-                        if component_key in obj:
-                            component_id = obj[component_key]
-                            if component_id in component_library["components"]:
-                                obj[component_key] = component_library["components"][component_id]
-                                if component_id not in self.data["components"]:
-                                    self.data["components"][component_id] = component_library["components"][component_id]
-
-                                if component_id in tests_by_component_control and control_id in tests_by_component_control[component_id]:
-                                    obj["tests"] += tests_by_component_control[component_id][control_id]
+
+class DataReporter():
+
+    def __init__(self, project: config.Project, threatmodel: threatmodel.ThreatModel):
+        self.project = project
+        self.threatmodel = threatmodel
+        self.data = None
+        self.build_report()
+
+    def build_report(self):
+        self.data = ReportData(self.project, self.threatmodel)
 
 
 class Reporter():
@@ -162,42 +307,44 @@ class Reporter():
 class TemplateReporter(Reporter):
     def generate(self, filename, template_path):
 
-        template_dir = os.path.dirname(template_path)
+        template_dir = os.path.abspath(os.path.dirname(template_path))
         template_file = os.path.basename(template_path)
 
-        template_loader = FileSystemLoader(template_dir)
-        template_env = Environment(loader=template_loader)
-        template = template_env.get_template(template_file)
+        template = template_environment(template_dir).get_template(template_file)
 
-        data.write_file(template.render(report=self.data), filename)
+        with profiling.phase("template render"):
+            data.write_stream(template.generate(report=self.data), filename)
 
 
 class MarkdownReporter(Reporter):
 
-    def generate(self, filename, image=None):
-        self.data["repository_url"] = self.config.repository_url
+    def generate(self, filename, image=None, diagrams=None):
+        # Overlay rather than modify the report data, which other reporters may share
+        report = ChainMap({"repository_url": self.config.repository_url}, self.data)
 
-        template_loader = PackageLoader('threatspec', 'report_templates')
-        template_env = Environment(loader=template_loader)
-        template = template_env.get_template('default_markdown.md')
+        template = template_environment().get_template('default_markdown.md')
 
-        data.write_file(template.render(report=self.data, image=image), filename)
+        with profiling.phase("template render"):
+            data.write_stream(template.generate(report=report, image=image, diagrams=diagrams), filename)
 
 
 class JsonReporter(Reporter):
 
     def generate(self, filename):
-        data.write_json_pretty(self.data, filename)
+        data.write_json_pretty(self.data, filename, default=json_default)
 
 
 class TextReporter(Reporter):
 
     def generate(self, filename):
-        template_loader = PackageLoader('threatspec', 'report_templates')
-        template_env = Environment(loader=template_loader)
-        template = template_env.get_template('default_text.txt')
+        template = template_environment().get_template('default_text.txt')
+
+        with profiling.phase("template render"):
+            data.write_stream(template.generate(report=self.data), filename)
+
 
-        data.write_file(template.render(report=self.data), filename)
+def source_digest(graph):
+    return hashlib.sha1(graph.dot.source.encode("utf-8")).hexdigest()
 
 
 class Graph():
@@ -224,11 +371,15 @@ class Graph():
 
 class GraphvizReporter(Reporter):
 
-    def __init__(self, data):
+    def __init__(self, data, split=False, manifest=None, cache_dir=None):
         super().__init__(data)
         self.graph = Graph(self.data["project"]["name"])
         self.nodes = {}
         self.edges = {}
+        self.node_ids = {}
+        self.split = split
+        self.manifest = manifest
+        self.cache_dir = cache_dir
 
         red = "#c0392b"
         green = "#27ae60"
@@ -295,15 +446,149 @@ class GraphvizReporter(Reporter):
         if destination_node_id not in self.edges[source_node_id]:
             self.edges[source_node_id][destination_node_id] = config
 
-    def render(self, filename):
+    def record_id(self, kind, *parts):
+        """Returns a node id derived from the record's content, so the same model always
+        produces the same DOT source. Identical records still get a node each."""
+        digest = hashlib.sha1("\0".join([kind] + [str(part) for part in parts]).encode("utf-8")).hexdigest()
+        node_id = "{}_{}".format(kind, digest[:16])
+
+        count = self.node_ids.get(node_id, 0) + 1
+        self.node_ids[node_id] = count
+        if count > 1:
+            node_id = "{}_{}".format(node_id, count)
+        return node_id
+
+    def build_graph(self, node_ids=None):
+        graph = Graph(self.data["project"]["name"])
+
         for node_id, node in self.nodes.items():
-            self.graph.dot.node(node_id, node["label"], **node["config"])
+            if node_ids is None or node_id in node_ids:
+                graph.dot.node(node_id, node["label"], **node["config"])
 
         for source_node_id in self.edges.keys():
+            if node_ids is not None and source_node_id not in node_ids:
+                continue
             for destination_node_id, cfg in self.edges[source_node_id].items():
-                self.graph.dot.edge(source_node_id, destination_node_id, **cfg)
+                if node_ids is None or destination_node_id in node_ids:
+                    graph.dot.edge(source_node_id, destination_node_id, **cfg)
 
-        self.graph.dot.render(filename, cleanup=True)
+        return graph
+
+    def render(self, filename):
+        self.graph = self.build_graph()
+        self.render_graph(self.graph, "{}.{}".format(filename, self.graph.dot.format))
+
+    def render_graph(self, graph, output_file, digest=None):
+        """Lays out the graph into output_file, reusing the image previously rendered from
+        the same DOT source if there is a cache directory."""
+        with profiling.phase("graph render"):
+            self.render_graph_file(graph, output_file, digest)
+
+    def render_graph_file(self, graph, output_file, digest=None):
+        if not self.cache_dir:
+            data.write_bytes(graph.dot.pipe(), output_file)
+            return
+
+        if digest is None:
+            digest = source_digest(graph)
+        cache_file = os.path.join(self.cache_dir, "{}.{}".format(digest, graph.dot.format))
+        if os.path.isfile(cache_file):
+            logger.debug("Using cached diagram {} for {}".format(cache_file, output_file))
+            shutil.copyfile(cache_file, output_file)
+            return
+
+        image = graph.dot.pipe()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data.write_bytes(image, cache_file + ".tmp")
+        os.replace(cache_file + ".tmp", cache_file)
+        data.write_bytes(image, output_file)
+
+    def prune_cache(self, digests):
+        """Removes the cached diagrams that aren't one of the given digests, so the cache
+        only holds the images of the diagrams currently in the manifest."""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        for cache_file in os.listdir(self.cache_dir):
+            if cache_file.split(".", 1)[0] not in digests:
+                logger.debug("Removing unused cached diagram {}".format(cache_file))
+                try:
+                    os.remove(os.path.join(self.cache_dir, cache_file))
+                except FileNotFoundError:
+                    pass
+
+    def component_groups(self):
+        """Returns the names of the top-level components of each component, i.e. the first
+        element of each of its paths, or its own name if it doesn't have any paths."""
+        groups = {}
+        for component_id, component in self.data["components"].items():
+            groups[component_id] = set(path[0] for path in component["paths"] if path) or {component["name"]}
+        return groups
+
+    def diagram_files(self, filename):
+        """Returns the diagram filename for each top-level component in split mode, or
+        the single diagram otherwise."""
+        if not self.split:
+            return {None: "{}.{}".format(filename, self.graph.dot.format)}
+
+        files = {}
+        used = set()
+        for group in sorted(set().union(*self.component_groups().values())):
+            name = re.sub(r"[^\w.-]+", "_", group).strip("_").lower() or "component"
+            slug = name
+            i = 1
+            while slug in used:
+                i += 1
+                slug = "{}_{}".format(name, i)
+            used.add(slug)
+            files[group] = "{}.{}.{}".format(filename, slug, self.graph.dot.format)
+        return files
+
+    def group_nodes(self, groups):
+        """Returns the ids of the nodes in each top-level component's diagram: its
+        components, the mitigations etc. attached to them, and what those connect to."""
+        neighbours = {}
+        for source_node_id, destinations in self.edges.items():
+            for destination_node_id in destinations:
+                neighbours.setdefault(source_node_id, set()).add(destination_node_id)
+                neighbours.setdefault(destination_node_id, set()).add(source_node_id)
+
+        components = set()
+        group_components = {}
+        for component_id, component in self.data["components"].items():
+            components.add(component_id)
+            for group in groups[component_id]:
+                members = group_components.setdefault(group, set())
+                members.add(component_id)
+                for path in component["paths"]:
+                    components.update(path)
+                    if path and path[0] == group:
+                        members.update(path)
+        library = components | set(self.data["threats"].keys()) | set(self.data["controls"].keys())
+
+        nodes = {}
+        for group, members in group_components.items():
+            records = set()
+            for node_id in members:
+                records.update(n for n in neighbours.get(node_id, ()) if n not in library)
+            group_nodes = set(members) | records
+            for node_id in records:
+                group_nodes.update(neighbours.get(node_id, ()))
+            for node_id in members:
+                group_nodes.update(n for n in neighbours.get(node_id, ()) if n in components)
+            nodes[group] = group_nodes
+        return nodes
+
+    def load_manifest(self):
+        if not self.manifest:
+            return {}
+        try:
+            return data.read_json(self.manifest)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        if self.manifest:
+            data.write_json_pretty(manifest, self.manifest)
 
     def process_threats(self):
         for threat_id, threat in self.data["threats"].items():
@@ -348,7 +633,6 @@ class GraphvizReporter(Reporter):
 
     def process_mitigations(self):
         for mitigation in self.data["threatmodel"]["mitigations"]:
-            mitigation_id = random_id()
             control = join(mitigation["control"]["name"].title(), mitigation["control"]["description"])
 
             mitigation_label = "{}\n\n{}\n\nin {}:{}".format(
@@ -357,6 +641,7 @@ class GraphvizReporter(Reporter):
                 trunc_left(mitigation["source"]["filename"], self.node_width - 10),
                 str(mitigation["source"]["line"])
             )
+            mitigation_id = self.record_id("mitigation", mitigation["threat"]["id"], mitigation["control"]["id"], mitigation["component"]["id"], mitigation_label)
             self.add_node(mitigation_id, mitigation_label, self.config["mitigation"])
 
             self.add_edge(mitigation["threat"]["id"], mitigation_id, self.config["threat_mitigation_edge"])
@@ -365,8 +650,6 @@ class GraphvizReporter(Reporter):
 
     def process_acceptances(self):
         for acceptance in self.data["threatmodel"]["acceptances"]:
-            acceptance_id = random_id()
-
             acceptance_label = "{}\n\n{}\n\nin {}:{}".format(
                 wrap("Threat has been accepted by {}".format(acceptance["details"]), self.node_width),
                 left_align(code(acceptance["source"]["code"], self.node_width - 10)),
@@ -374,6 +657,7 @@ class GraphvizReporter(Reporter):
                 str(acceptance["source"]["line"])
             )
 
+            acceptance_id = self.record_id("acceptance", acceptance["threat"]["id"], acceptance["component"]["id"], acceptance_label)
             self.add_node(acceptance_id, acceptance_label, self.config["acceptance"])
 
             self.add_edge(acceptance["threat"]["id"], acceptance_id, self.config["threat_acceptance_edge"])
@@ -381,8 +665,6 @@ class GraphvizReporter(Reporter):
 
     def process_exposures(self):
         for exposure in self.data["threatmodel"]["exposures"]:
-            exposure_id = random_id()
-
             exposure_label = "{}\n\n{}\n\nin {}:{}".format(
                 wrap("Threat is exposed by {}".format(exposure["details"]), self.node_width),
                 left_align(code(exposure["source"]["code"], self.node_width - 10)),
@@ -390,6 +672,7 @@ class GraphvizReporter(Reporter):
                 str(exposure["source"]["line"])
             )
 
+            exposure_id = self.record_id("exposure", exposure["threat"]["id"], exposure["component"]["id"], exposure_label)
             self.add_node(exposure_id, exposure_label, self.config["exposure"])
 
             self.add_edge(exposure["threat"]["id"], exposure_id, self.config["threat_exposure_edge"])
@@ -397,8 +680,6 @@ class GraphvizReporter(Reporter):
 
     def process_transfers(self):
         for transfer in self.data["threatmodel"]["transfers"]:
-            transfer_id = random_id()
-
             transfer_label = "{}\n\n{}\n\nin {}:{}".format(
                 wrap("Threat is transfered to another component by {}".format(transfer["details"]), self.node_width),
                 left_align(code(transfer["source"]["code"], self.node_width - 10)),
@@ -406,6 +687,7 @@ class GraphvizReporter(Reporter):
                 str(transfer["source"]["line"])
             )
 
+            transfer_id = self.record_id("transfer", transfer["threat"]["id"], transfer["source_component"]["id"], transfer["destination_component"]["id"], transfer_label)
             self.add_node(transfer_id, transfer_label, self.config["transfer"])
 
             self.add_edge(transfer["threat"]["id"], transfer_id, self.config["threat_transfer_edge"])
@@ -414,13 +696,13 @@ class GraphvizReporter(Reporter):
 
     def process_reviews(self):
         for review in self.data["threatmodel"]["reviews"]:
-            review_id = random_id()
             review_label = "{}\n\n{}\n\nin {}:{}".format(
                 wrap("To review: {}".format(review["details"]), self.node_width),
                 left_align(code(review["source"]["code"], self.node_width - 10)),
                 trunc_left(review["source"]["filename"], self.node_width - 10),
                 str(review["source"]["line"])
             )
+            review_id = self.record_id("review", review["component"]["id"], review_label)
             self.add_node(review_id, review_label, self.config["review"])
 
             self.add_edge(review_id, review["component"]["id"], self.config["review_component_edge"])
@@ -433,19 +715,19 @@ class GraphvizReporter(Reporter):
 
     def process_tests(self):
         for test in self.data["threatmodel"]["tests"]:
-            test_id = random_id()
-
             test_label = "Control is tested for component\n\n{}\n\nin {}:{}".format(
                 left_align(code(test["source"]["code"], self.node_width - 10)),
                 trunc_left(test["source"]["filename"], self.node_width - 10),
                 str(test["source"]["line"])
             )
+            test_id = self.record_id("test", test["control"]["id"], test["component"]["id"], test_label)
             self.add_node(test_id, test_label, self.config["test"])
 
             self.add_edge(test["control"]["id"], test_id, self.config["control_test_edge"])
             self.add_edge(test_id, test["component"]["id"], self.config["test_component_edge"])
 
-    def generate(self, filename):
+    def process(self):
+        """Collects the nodes and edges of the whole threat model."""
         self.process_threats()
         self.process_controls()
         self.process_components()
@@ -459,4 +741,43 @@ class GraphvizReporter(Reporter):
         self.process_connections()
         self.process_tests()
 
-        self.render(filename)
+    def generate(self, filename):
+        with profiling.phase("graph build"):
+            self.process()
+
+            files = self.diagram_files(filename)
+            if self.split:
+                group_nodes = self.group_nodes(self.component_groups())
+                graphs = [(self.build_graph(group_nodes[group]), output_file) for group, output_file in files.items()]
+            else:
+                self.graph = self.build_graph()
+                graphs = [(self.graph, files[None])]
+
+        if self.manifest or self.cache_dir:
+            with diagram_lock:
+                return self.render_graphs(graphs, files)
+        return self.render_graphs(graphs, files)
+
+    def render_graphs(self, graphs, files):
+        # Diagrams whose DOT source hasn't changed since they were last rendered are kept
+        manifest = self.load_manifest()
+        pending = []
+        for graph, output_file in graphs:
+            digest = source_digest(graph)
+            if manifest.get(output_file) == digest and os.path.isfile(output_file):
+                logger.debug("Diagram {} is unchanged".format(output_file))
+            else:
+                pending.append((graph, output_file, digest))
+
+        # Layout happens in separate dot processes, so threads are enough to use every core
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(pending), os.cpu_count() or 1))) as executor:
+            futures = [(executor.submit(self.render_graph, graph, output_file, digest), output_file, digest) for (graph, output_file, digest) in pending]
+            for (future, output_file, digest) in futures:
+                future.result()
+                manifest[output_file] = digest
+
+        # Forget diagrams that have since been deleted, so their images can be pruned
+        manifest = {output_file: digest for (output_file, digest) in manifest.items() if os.path.isfile(output_file)}
+        self.save_manifest(manifest)
+        self.prune_cache(set(manifest.values()) | set(digest for (graph, output_file, digest) in pending))
+        return list(files.values())
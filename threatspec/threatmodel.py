@@ -1,12 +1,17 @@
 from typing import List, Dict
 import re
+import sys
+import json
+import functools
 
 
 class Source():
+    __slots__ = ("annotation", "code", "filename", "line")
+
     def __init__(self, annotation: str, code: str, filename: str, line: int):
         self.annotation = annotation
         self.code = code
-        self.filename = filename
+        self.filename = sys.intern(filename)
         self.line = line
         
     def as_dict(self):
@@ -19,6 +24,8 @@ class Source():
 
 
 class Threat():
+    __slots__ = ("id", "run_id", "name", "description", "custom")
+
     def __init__(self, id: str, run_id: str, name: str, description: str, custom: dict):
         self.id = id
         self.run_id = run_id
@@ -47,6 +54,8 @@ class Threat():
 
 
 class Control():
+    __slots__ = ("id", "run_id", "name", "description", "custom")
+
     def __init__(self, id: str, run_id: str, name: str, description: str, custom: dict):
         self.id = id
         self.run_id = run_id
@@ -75,6 +84,8 @@ class Control():
 
 
 class Component():
+    __slots__ = ("id", "run_id", "name", "description", "paths", "custom")
+
     def __init__(self, id: str, run_id: str, name: str, description: str, paths: List[str], custom: dict):
         self.id = id
         self.run_id = run_id
@@ -107,6 +118,8 @@ class Component():
 
 
 class Mitigation():
+    __slots__ = ("control", "threat", "component", "description", "custom", "source")
+
     def __init__(self, control: Control, threat: Threat, component: Component, description: str, custom: dict, source: Source):
         self.control = control
         self.threat = threat
@@ -127,6 +140,8 @@ class Mitigation():
 
 
 class Acceptance():
+    __slots__ = ("threat", "component", "details", "description", "custom", "source")
+
     def __init__(self, threat: Threat, component: Component, details: str, description: str, custom: dict, source: Source):
         self.threat = threat
         self.component = component
@@ -147,6 +162,8 @@ class Acceptance():
 
 
 class Transfer():
+    __slots__ = ("threat", "source_component", "destination_component", "details", "description", "custom", "source")
+
     def __init__(self, threat: Threat, source_component: Component, destination_component: Component, details: str, description: str, custom: dict, source: Source):
         self.threat = threat
         self.source_component = source_component
@@ -169,6 +186,8 @@ class Transfer():
 
 
 class Exposure():
+    __slots__ = ("threat", "component", "details", "description", "custom", "source")
+
     def __init__(self, threat: Threat, component: Component, details: str, description: str, custom: dict, source: Source):
         self.threat = threat
         self.component = component
@@ -189,6 +208,8 @@ class Exposure():
 
 
 class Connection():
+    __slots__ = ("source_component", "destination_component", "direction", "details", "description", "custom", "source")
+
     def __init__(self, source_component: Component, destination_component: Component, direction: str, details: str, description: str, custom: dict, source: Source):
         self.source_component = source_component
         self.destination_component = destination_component
@@ -211,6 +232,8 @@ class Connection():
 
 
 class Review():
+    __slots__ = ("component", "details", "description", "custom", "source")
+
     def __init__(self, component: Component, details: str, description: str, custom: dict, source: Source):
         self.component = component
         self.details = details
@@ -229,6 +252,8 @@ class Review():
 
 
 class Test():
+    __slots__ = ("component", "control", "description", "custom", "source")
+
     def __init__(self, component: Component, control: Control, description: str, custom: dict, source: Source):
         self.component = component
         self.control = control
@@ -246,19 +271,27 @@ class Test():
         }
 
 
+ID_PATTERN = re.compile(r'^#[a-zA-Z0-9_]+$', re.M)
+NAME_PATTERN = re.compile(r'(?P<name>[^()]+)(?:(?P<id>\(.*?\)))?', re.M | re.I)
+ID_CHARS = re.compile('[^a-z0-9_]+')
+
+
 class Library():
     # TODO - move this into parser.py
-    def parse_name(self, data):
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def parse_name(data):
+        # The same names repeat across many annotations, so the (name, id) results are cached
         name = ""
         id = ""
         
         # Don't parse if all we have is an ID
-        m = re.match(r'^#[a-zA-Z0-9_]+$', data, re.M)
+        m = ID_PATTERN.match(data)
         if m:
-            return ("", data)
+            return ("", sys.intern(data))
 
         # TODO - write tests then handle special global ids #client and #server
-        m = re.match(r'(?P<name>[^()]+)(?:(?P<id>\(.*?\)))?', data, re.M | re.I)
+        m = NAME_PATTERN.match(data)
         if m:
             match = m.groupdict()
             
@@ -274,7 +307,7 @@ class Library():
                     id_body = name + "root"
                 else:
                     id_body = name
-                id = "#" + re.sub('[^a-z0-9_]+', '_', id_body.strip().lower().replace('-', '')).strip('_')
+                id = "#" + ID_CHARS.sub('_', id_body.strip().lower().replace('-', '')).strip('_')
 
             if id[0] == "(" and id[-1] == ")":
                 id = id[1:-1]
@@ -284,16 +317,16 @@ class Library():
                     id_body = id + "root"
                 else:
                     id_body = id
-                id = "#" + re.sub('[^a-z0-9_]+', '_', id_body.strip().lower().replace('-', '')).strip('_')
+                id = "#" + ID_CHARS.sub('_', id_body.strip().lower().replace('-', '')).strip('_')
 
-            return (name, id)
+            return (name, sys.intern(id))
         else:
             raise RuntimeError("Failed to parse ID: {}".format(data))
 
 
 class ThreatLibrary(Library):
-    def __init__(self, threats: Dict[str, Threat] = {}):
-        self.threats = threats
+    def __init__(self, threats: Dict[str, Threat] = None):
+        self.threats = threats if threats is not None else {}
 
     def add_threat(self, data, run_id=None):
         if isinstance(data, dict):
@@ -336,8 +369,8 @@ class ThreatLibrary(Library):
 
         
 class ControlLibrary(Library):
-    def __init__(self, controls: Dict[str, Control] = {}):
-        self.controls = controls
+    def __init__(self, controls: Dict[str, Control] = None):
+        self.controls = controls if controls is not None else {}
 
     def add_control(self, data, run_id=None):
         if isinstance(data, dict):
@@ -380,8 +413,8 @@ class ControlLibrary(Library):
 
 
 class ComponentLibrary(Library):
-    def __init__(self, components: Dict[str, Component] = {}):
-        self.components = components
+    def __init__(self, components: Dict[str, Component] = None):
+        self.components = components if components is not None else {}
 
     def add_component(self, data, run_id=None):
         if isinstance(data, dict):
@@ -432,28 +465,150 @@ class ComponentLibrary(Library):
 
 class ThreatModel(Library):
     def __init__(self,
-            mitigations: List[Mitigation] = [],
-            acceptances: List[Acceptance] = [],
-            transfers: List[Transfer] = [],
-            exposures: List[Exposure] = [],
-            connections: List[Connection] = [],
-            reviews: List[Review] = [],
-            tests: List[Test] = [],
+            mitigations: List[Mitigation] = None,
+            acceptances: List[Acceptance] = None,
+            transfers: List[Transfer] = None,
+            exposures: List[Exposure] = None,
+            connections: List[Connection] = None,
+            reviews: List[Review] = None,
+            tests: List[Test] = None,
             run_id: str = ""):
         
-        self.mitigations = mitigations
-        self.acceptances = acceptances
-        self.transfers = transfers
-        self.exposures = exposures
-        self.connections = connections
-        self.reviews = reviews
-        self.tests = tests
+        self.mitigations = mitigations if mitigations is not None else []
+        self.acceptances = acceptances if acceptances is not None else []
+        self.transfers = transfers if transfers is not None else []
+        self.exposures = exposures if exposures is not None else []
+        self.connections = connections if connections is not None else []
+        self.reviews = reviews if reviews is not None else []
+        self.tests = tests if tests is not None else []
         self.run_id = run_id
         
         self.threat_library = None
         self.control_library = None
         self.component_library = None
 
+        self.stream = None
+
+        self.component_index = {}
+        self.threat_index = {}
+        self.control_index = {}
+
+        self.code_snippets = {}
+
+    def new_source(self, source):
+        source = Source(**source)
+        # Annotations in the same comment share their code, so only keep one copy of it
+        source.code = self.code_snippets.setdefault(source.code, source.code)
+        return source
+
+    def add_record(self, kind, records, record):
+        if self.stream:
+            self.write_record(kind, record.as_dict())
+        else:
+            records.append(record)
+            self.index_record(kind, record)
+
+    def index_record(self, kind, record):
+        indexes = [
+            (self.component_index, ["component", "source_component", "destination_component"]),
+            (self.threat_index, ["threat"]),
+            (self.control_index, ["control"])
+        ]
+        for (index, keys) in indexes:
+            ids = []
+            for key in keys:
+                id = getattr(record, key, None)
+                if id and id not in ids:
+                    ids.append(id)
+            for id in ids:
+                index.setdefault(id, {}).setdefault(kind, []).append(record)
+
+    def records_for_component(self, component_id, kind):
+        return self.component_index.get(component_id, {}).get(kind, [])
+
+    def records_for_threat(self, threat_id, kind):
+        return self.threat_index.get(threat_id, {}).get(kind, [])
+
+    def records_for_control(self, control_id, kind):
+        return self.control_index.get(control_id, {}).get(kind, [])
+
+    def mitigations_for(self, component_id):
+        return self.records_for_component(component_id, "mitigation")
+
+    def exposures_for(self, component_id):
+        return self.records_for_component(component_id, "exposure")
+
+    def tests_for(self, component_id, control_id=None):
+        tests = self.records_for_component(component_id, "test")
+        if control_id:
+            return [test for test in tests if test.control == control_id]
+        return tests
+
+    def threats_for(self, component_id):
+        """Returns the ids of the threats mitigated, accepted, exposed or transferred for a component."""
+        threat_ids = []
+        for records in self.component_index.get(component_id, {}).values():
+            for record in records:
+                threat_id = getattr(record, "threat", None)
+                if threat_id and threat_id not in threat_ids:
+                    threat_ids.append(threat_id)
+        return threat_ids
+
+    def unmitigated_exposures(self):
+        """Returns the exposures with no mitigation for the same threat on the same component."""
+        unmitigated = []
+        for exposure in self.exposures:
+            mitigated_threats = {mitigation.threat for mitigation in self.mitigations_for(exposure.component)}
+            if exposure.threat not in mitigated_threats:
+                unmitigated.append(exposure)
+        return unmitigated
+
+    def record_lists(self):
+        return [
+            ("mitigation", self.mitigations),
+            ("exposure", self.exposures),
+            ("transfer", self.transfers),
+            ("acceptance", self.acceptances),
+            ("connection", self.connections),
+            ("review", self.reviews),
+            ("test", self.tests)
+        ]
+
+    def source_filenames(self):
+        return {record.source.filename for (kind, records) in self.record_lists() for record in records}
+
+    def remove_sources(self, filenames):
+        """Removes the records annotated in the given source files, e.g. before parsing
+        them again, and returns how many were removed."""
+        self.component_index = {}
+        self.threat_index = {}
+        self.control_index = {}
+        self.code_snippets = {}
+
+        removed = 0
+        for (kind, records) in self.record_lists():
+            kept = [record for record in records if record.source.filename not in filenames]
+            removed += len(records) - len(kept)
+            records[:] = kept
+            for record in kept:
+                self.index_record(kind, record)
+                record.source.code = self.code_snippets.setdefault(record.source.code, record.source.code)
+        return removed
+
+    def write_record(self, kind, record):
+        line = {"kind": kind}
+        line.update(record)
+        self.stream.write(json.dumps(line) + "\n")
+
+    def open_stream(self, stream):
+        """Write records to an NDJSON stream as they are added, instead of keeping them in memory."""
+        self.stream = stream
+        self.write_record("threatmodel", {"run_id": self.run_id})
+
+    def close_stream(self):
+        self.stream.close()
+        self.stream = None
+
     def add_mitigation(self, data, source):
         control = self.control_library.add_control(data.pop("control"), self.run_id)
         threat = self.threat_library.add_threat(data.pop("threat"), self.run_id)
@@ -463,7 +618,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.mitigations.append(Mitigation(control, threat, component, description, custom, Source(**source)))
+        self.add_record("mitigation", self.mitigations, Mitigation(control, threat, component, description, custom, self.new_source(source)))
 
     def add_acceptance(self, data, source):
         threat = self.threat_library.add_threat(data.pop("threat"), self.run_id)
@@ -474,7 +629,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.acceptances.append(Acceptance(threat, component, details, description, custom, Source(**source)))
+        self.add_record("acceptance", self.acceptances, Acceptance(threat, component, details, description, custom, self.new_source(source)))
 
     def add_transfer(self, data, source):
         threat = self.threat_library.add_threat(data.pop("threat"), self.run_id)
@@ -486,7 +641,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.transfers.append(Transfer(threat, source_component, destination_component, details, description, custom, Source(**source)))
+        self.add_record("transfer", self.transfers, Transfer(threat, source_component, destination_component, details, description, custom, self.new_source(source)))
 
     def add_exposure(self, data, source):
         threat = self.threat_library.add_threat(data.pop("threat"), self.run_id)
@@ -497,7 +652,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.exposures.append(Exposure(threat, component, details, description, custom, Source(**source)))
+        self.add_record("exposure", self.exposures, Exposure(threat, component, details, description, custom, self.new_source(source)))
 
     def add_connection(self, data, source):
         source_component = self.component_library.add_component(data.pop("source_component"), self.run_id)
@@ -509,7 +664,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.connections.append(Connection(source_component, destination_component, direction, details, description, custom, Source(**source)))
+        self.add_record("connection", self.connections, Connection(source_component, destination_component, direction, details, description, custom, self.new_source(source)))
 
     def add_review(self, data, source):
         component = self.component_library.add_component(data.pop("component"), self.run_id)
@@ -519,7 +674,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.reviews.append(Review(component, details, description, custom, Source(**source)))
+        self.add_record("review", self.reviews, Review(component, details, description, custom, self.new_source(source)))
 
     def add_test(self, data, source):
         component = self.component_library.add_component(data.pop("component"), self.run_id)
@@ -529,7 +684,7 @@ class ThreatModel(Library):
             custom = data["custom"]
         else:
             custom = data
-        self.tests.append(Test(component, control, description, custom, Source(**source)))
+        self.add_record("test", self.tests, Test(component, control, description, custom, self.new_source(source)))
 
     def add_threat(self, data, source):
         self.threat_library.add_threat(data, self.run_id)
@@ -555,7 +710,22 @@ class ThreatModel(Library):
             self.add_review(review, review.pop("source"))
         for test in data["tests"]:
             self.add_test(test, test.pop("source"))
-            
+
+    def load_records(self, records):
+        loaders = {
+            "mitigation": self.add_mitigation,
+            "exposure": self.add_exposure,
+            "transfer": self.add_transfer,
+            "acceptance": self.add_acceptance,
+            "connection": self.add_connection,
+            "review": self.add_review,
+            "test": self.add_test
+        }
+        for record in records:
+            kind = record.pop("kind")
+            if kind in loaders:
+                loaders[kind](record, record.pop("source"))
+
     def save(self):
         return {
             "mitigations": [x.as_dict() for x in self.mitigations],
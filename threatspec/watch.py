@@ -0,0 +1,198 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import abc
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """Reports the paths that change. poll() returns a set of paths, which is empty if
+    nothing changed within the timeout, or None if changes may have been missed and
+    everything needs to be checked again."""
+
+    @abc.abstractmethod
+    def poll(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+    def changes(self, debounce=0.1):
+        """Yields the paths changed in each burst of changes, once nothing else has
+        changed for debounce seconds. Editors often write a file in several steps, and
+        a checkout touches many files at once."""
+        while True:
+            changed = self.poll()
+            if changed is not None and not changed:
+                continue
+            while True:
+                more = self.poll(debounce)
+                if more is not None and not more:
+                    break
+                if changed is None or more is None:
+                    changed = None
+                else:
+                    changed |= more
+            yield changed
+
+
+class PollingWatcher(Watcher):
+    """Finds changes by comparing the modification time and size of the files returned
+    by list_files every interval seconds."""
+
+    def __init__(self, list_files, interval=0.5):
+        self.list_files = list_files
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for path in self.list_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                time.sleep(max(0, min(self.interval, deadline - time.monotonic())))
+
+            snapshot = self.scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class InotifyWatcher(Watcher):
+    """Uses inotify to be told about changes in the given directories as they happen.
+    Directories created later are watched as well if directory_filter accepts them, and
+    the files already in them are reported as changed."""
+
+    def __init__(self, directories, libc=None, directory_filter=None):
+        self.directory_filter = directory_filter
+        self.libc = libc or load_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.directories = {}
+        try:
+            for directory in directories:
+                self.add_directory(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def add_directory(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                logger.debug("Couldn't watch directory {}: {}".format(directory, os.strerror(e)))
+                return
+            # ENOSPC means the inotify watch limit (fs.inotify.max_user_watches) was reached
+            raise OSError(e, "Couldn't watch directory {}: {}".format(directory, os.strerror(e)))
+        self.directories[wd] = directory
+
+    def watched(self, directory):
+        return self.directory_filter is None or self.directory_filter(directory)
+
+    def add_tree(self, directory):
+        changed = set()
+        if not self.watched(directory):
+            return changed
+        for (root, dirs, files) in os.walk(directory):
+            # Ignored directories such as node_modules would use up the inotify watches
+            dirs[:] = [d for d in dirs if not d.startswith(".") and self.watched(os.path.join(root, d))]
+            self.add_directory(root)
+            changed.update(os.path.join(root, f) for f in files)
+        return changed
+
+    def read_events(self):
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buf):
+            (wd, mask, cookie, length) = EVENT.unpack_from(buf, offset)
+            offset += EVENT.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            yield (wd, mask, name)
+
+    def poll(self, timeout=None):
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        for (wd, mask, name) in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logger.warn("Too many changes at once, checking all the source files again")
+                return None
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name or name.startswith("."):
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    changed |= self.add_tree(path)
+                except OSError as e:
+                    logger.warn("{}, checking all the source files again".format(str(e)))
+                    return None
+            changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1